@@ -1,14 +1,206 @@
-from flask import Flask, render_template_string, request
+from flask import Flask, Response, jsonify, render_template_string, request, url_for
 import torch
-from resnet_lstm_model import ResNetLSTMModel
-from data_preprocessing import load_and_preprocess_video
+from data_preprocessing import load_and_preprocess_video, preprocess_frames
+from face_crop import crop_frames, detect_face_boxes
+from inference_server import BatchingInferenceWorker
+from feature_cache import FeatureCache, content_hash
+from prediction_cache import PredictionCache, make_key
+from streaming_inference import stream_predict
+from export_model import load_exported_model
+from model_registry import ModelRegistry, load_model
+from ensemble import EnsembleDetector, load_calibration
+from job_queue import JobQueue, JobQueueFull
+from upload_ingest import IngestRequest
+import metrics
 import os
+import threading
+import time
+
+startup_started = time.perf_counter()
 
 app = Flask(__name__)
 
-model = ResNetLSTMModel()
-model.load_state_dict(torch.load("path/to/your/model.pth"))
-model.eval()
+# Micro-batching configuration, tune for throughput versus tail latency
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+INFERENCE_MAX_QUEUE_SIZE = int(os.environ.get('INFERENCE_MAX_QUEUE_SIZE', 64))
+
+NUM_FRAMES = 10
+# Pick the most informative frames in one sequential pass instead of seeking to fixed intervals
+ADAPTIVE_SAMPLING = os.environ.get('ADAPTIVE_SAMPLING', '0') == '1'
+
+MODEL_CHECKPOINT = os.environ.get('MODEL_CHECKPOINT', "path/to/your/model.pth")
+
+# Serve from a TorchScript/ONNX artifact written by export_model.py instead of the eager model
+MODEL_ARTIFACT = os.environ.get('MODEL_ARTIFACT')
+
+# Backbone feature cache, enabled by pointing FEATURE_CACHE_DIR at a writable directory
+FEATURE_CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR')
+
+# Streaming inference reads the video in chunks and answers as soon as the prediction is stable
+STREAMING_INFERENCE = os.environ.get('STREAMING_INFERENCE', '0') == '1'
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 4))
+STREAM_SAMPLE_FPS = float(os.environ.get('STREAM_SAMPLE_FPS', 2.0))
+STREAM_MAX_FRAMES = int(os.environ.get('STREAM_MAX_FRAMES', 64))
+STREAM_FAKE_THRESHOLD = float(os.environ.get('STREAM_FAKE_THRESHOLD', 0.9))
+STREAM_REAL_THRESHOLD = float(os.environ.get('STREAM_REAL_THRESHOLD', 0.1))
+STREAM_PATIENCE = int(os.environ.get('STREAM_PATIENCE', 3))
+
+# Crop frames to the tracked face before the backbone, the model should be trained with face_crop too
+FACE_CROP = os.environ.get('FACE_CROP', '0') == '1'
+
+# Async job mode: /predict returns a job ID at once and background workers run the prediction.
+# It can also be requested per upload with /predict?async=1
+ASYNC_JOBS = os.environ.get('ASYNC_JOBS', '0') == '1'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 600))
+JOB_RETRY_AFTER = int(os.environ.get('JOB_RETRY_AFTER', 5))
+# Job states and results are kept in this SQLite file, so a poll is answered by whichever worker process
+# receives it. JOB_DB= (empty) keeps them in memory, which only works with a single worker process
+JOB_DB = os.environ.get('JOB_DB', 'jobs.db')
+
+# Uploads are never saved under their client file name: they are hashed into an anonymous in-memory file
+# (UPLOAD_SPOOL=tempfile uses an unlinked temporary file instead, which costs disk but not RAM)
+# that is freed with the request. Streamable containers (.ts/.webm/.mkv) are decoded while they
+# upload when PyAV is installed
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 200))
+UPLOAD_SPOOL = os.environ.get('UPLOAD_SPOOL', 'memory')
+
+# Prediction cache for repeated uploads, PREDICTION_CACHE_SIZE=0 disables it.
+# PREDICTION_CACHE_DB adds an SQLite tier that survives restarts
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 24 * 3600))
+PREDICTION_CACHE_DB = os.environ.get('PREDICTION_CACHE_DB')
+
+# Opt-in sampling profiler: PROFILE_EVERY_N=100 writes a torch.profiler trace of every 100th prediction
+PROFILE_EVERY_N = int(os.environ.get('PROFILE_EVERY_N', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Ensemble mode runs the ResNet detector and the ResNeXt detector from train.py on the same decoded
+# clip. Logits are averaged with ENSEMBLE_WEIGHTS ("resnet,resnext"), or combined by the calibration
+# written by `python ensemble.py` when ENSEMBLE_CALIBRATION is set
+ENSEMBLE = os.environ.get('ENSEMBLE', '0') == '1'
+RESNEXT_CHECKPOINT = os.environ.get('RESNEXT_CHECKPOINT', "path/to/your/resnext_model.pth")
+ENSEMBLE_WEIGHTS = [float(w) for w in os.environ.get('ENSEMBLE_WEIGHTS', '0.5,0.5').split(',')]
+ENSEMBLE_CALIBRATION = os.environ.get('ENSEMBLE_CALIBRATION')
+
+# The model is loaded on the first request. PRELOAD_MODEL=1 loads it at import instead, which with
+# gunicorn --preload lets every forked worker share the parent's read-only weights
+PRELOAD_MODEL = os.environ.get('PRELOAD_MODEL', '0') == '1'
+
+if ENSEMBLE and MODEL_ARTIFACT:
+    # The ensemble runs the eager models, exported artifacts are not combined
+    print("ENSEMBLE is set, ignoring MODEL_ARTIFACT")
+    MODEL_ARTIFACT = None
+
+if MODEL_ARTIFACT or ENSEMBLE:
+    # The artifact and the ensemble only expose the full forward pass, so the feature cache and streaming are off
+    FEATURE_CACHE_DIR = None
+    STREAMING_INFERENCE = False
+
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
+app.request_class = IngestRequest
+IngestRequest.max_upload_bytes = app.config['MAX_CONTENT_LENGTH']
+IngestRequest.spool_in_memory = UPLOAD_SPOOL == 'memory'
+# Streaming and adaptive sampling pick their own frames from the whole file
+IngestRequest.decode_frames = 0 if STREAMING_INFERENCE or ADAPTIVE_SAMPLING else NUM_FRAMES
+
+model_registry = ModelRegistry()
+model_registry.register('detector', lambda: load_exported_model(MODEL_ARTIFACT) if MODEL_ARTIFACT
+                        else load_model('resnet', MODEL_CHECKPOINT))
+
+if ENSEMBLE:
+    model_registry.register('resnext', lambda: load_model('resnext', RESNEXT_CHECKPOINT))
+    model_registry.register('ensemble', lambda: EnsembleDetector(
+        {'resnet': get_model(), 'resnext': model_registry.get('resnext')},
+        weights=dict(zip(('resnet', 'resnext'), ENSEMBLE_WEIGHTS)),
+        calibration=load_calibration(ENSEMBLE_CALIBRATION) if ENSEMBLE_CALIBRATION else None
+    ))
+
+def get_model():
+    return model_registry.get('detector')
+
+def get_ensemble():
+    return model_registry.get('ensemble')
+
+def get_model_device():
+    if MODEL_ARTIFACT:
+        return torch.device('cpu')
+    return next(get_model().parameters()).device
+
+_checkpoint_hash = None
+
+def get_checkpoint_hash():
+    # Hashing a large checkpoint is deferred along with loading it
+    global _checkpoint_hash
+    if _checkpoint_hash is None:
+        _checkpoint_hash = content_hash(MODEL_ARTIFACT or MODEL_CHECKPOINT)
+        if ENSEMBLE:
+            combination = content_hash(ENSEMBLE_CALIBRATION) if ENSEMBLE_CALIBRATION else ENSEMBLE_WEIGHTS
+            _checkpoint_hash = f"{_checkpoint_hash}+{content_hash(RESNEXT_CHECKPOINT)}+{combination}"
+    return _checkpoint_hash
+
+# Predictions are only reused for the same weights and the same frame sampling. A streamed prediction
+# depends on every streaming setting, the early exit included
+sampling_key = (f"stream{STREAM_MAX_FRAMES}-chunk{STREAM_CHUNK_SIZE}-fps{STREAM_SAMPLE_FPS}"
+                f"-exit{STREAM_FAKE_THRESHOLD},{STREAM_REAL_THRESHOLD},{STREAM_PATIENCE}"
+                if STREAMING_INFERENCE else NUM_FRAMES)
+if FACE_CROP:
+    sampling_key = f"{sampling_key}-faces"
+if ADAPTIVE_SAMPLING and not STREAMING_INFERENCE:
+    sampling_key = f"{sampling_key}-adaptive"
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl=PREDICTION_CACHE_TTL,
+    disk_path=PREDICTION_CACHE_DB
+) if PREDICTION_CACHE_SIZE > 0 else None
+
+feature_cache = None
+_feature_cache_lock = threading.Lock()
+
+def get_feature_cache():
+    # Opened on first use, like the model: its namespace needs the checkpoint hash
+    global feature_cache
+    if feature_cache is None:
+        with _feature_cache_lock:
+            if feature_cache is None:
+                feature_cache = FeatureCache(
+                    FEATURE_CACHE_DIR,
+                    # Features depend on the checkpoint's backbone, which frames are picked and how they are cropped
+                    backbone_name=f"resnet50-{get_checkpoint_hash()[:16]}" + ('-faces' if FACE_CROP else '')
+                                  + ('-adaptive' if ADAPTIVE_SAMPLING else '')
+                )
+    return feature_cache
+
+inference_worker = None
+_inference_worker_lock = threading.Lock()
+
+def get_inference_worker():
+    # Started lazily so the batching thread is created in the serving process, not before a fork
+    global inference_worker
+    if inference_worker is None:
+        with _inference_worker_lock:
+            if inference_worker is None:
+                model = get_model()
+                inference_worker = BatchingInferenceWorker(
+                    # With the feature cache only the backbone is batched, the LSTM head runs per request
+                    model.extract_features if FEATURE_CACHE_DIR else model,
+                    device=get_model_device(),
+                    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+                    max_queue_size=INFERENCE_MAX_QUEUE_SIZE
+                )
+    return inference_worker
+
+if PRELOAD_MODEL:
+    model_registry.preload()
+    get_checkpoint_hash()
+
+profiler = metrics.SamplingProfiler(every_n=PROFILE_EVERY_N, output_dir=PROFILE_DIR)
+
+startup_seconds = time.perf_counter() - startup_started
+print(f"App ready in {startup_seconds:.2f}s (model {'preloaded' if PRELOAD_MODEL else 'loads on first request'})")
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -33,6 +225,10 @@ HTML_TEMPLATE = """
         <div class="result">
             <p>Prediction: <strong>{{ result.prediction }}</strong></p>
             <p>Confidence: <strong>{{ result.confidence }}</strong></p>
+            <p>Frames analysed: <strong>{{ result.frames_used }}</strong></p>
+            {% for name, model_result in (result.per_model or {}).items() %}
+                <p>{{ name }}: {{ "%.2f%%"|format(model_result.confidence * 100) }} in {{ "%.0f"|format(model_result.compute_ms) }} ms</p>
+            {% endfor %}
         </div>
     {% endif %}
     {% if error %}
@@ -43,13 +239,192 @@ HTML_TEMPLATE = """
 </html>
 """
 
+def run_streaming_inference(filepath):
+    started = time.perf_counter()
+    inference = stream_predict(
+        get_model(),
+        filepath,
+        chunk_size=STREAM_CHUNK_SIZE,
+        sample_fps=STREAM_SAMPLE_FPS,
+        max_frames=STREAM_MAX_FRAMES,
+        fake_threshold=STREAM_FAKE_THRESHOLD,
+        real_threshold=STREAM_REAL_THRESHOLD,
+        patience=STREAM_PATIENCE,
+        face_crop=FACE_CROP
+    )
+    inference.update(queue_ms=0.0, compute_ms=(time.perf_counter() - started) * 1000)
+    metrics.observe('streaming_inference', inference['compute_ms'] / 1000)
+    return inference
+
+def record_worker_timings(inference):
+    metrics.observe('inference_queue', inference['queue_ms'] / 1000)
+    metrics.observe('inference_compute', inference['compute_ms'] / 1000)
+
+def load_frames(filepath, decoded=None):
+    if decoded is None:
+        return load_and_preprocess_video(filepath, num_frames=NUM_FRAMES, face_crop=FACE_CROP,
+                                         adaptive=ADAPTIVE_SAMPLING)
+    # The sampled frames were already decoded while the upload streamed in
+    if FACE_CROP:
+        with metrics.span('face_crop'):
+            decoded = crop_frames(decoded, detect_face_boxes(decoded))
+    with metrics.span('preprocess'):
+        return preprocess_frames(decoded)
+
+def worker_predict(frames, inline=False):
+    # Profiled requests run on their own thread, the profiler does not see the batching worker's
+    worker = get_inference_worker()
+    return worker.predict_inline(frames) if inline else worker.predict(frames)
+
+def run_ensemble_inference(filepath, decoded=None, inline=False):
+    # Decoded and normalized once, both backbones read the same tensor
+    frames = load_frames(filepath, decoded)
+    ensemble = get_ensemble()
+    output = ensemble.predict(frames, concurrent=not inline)
+    for name, result in output['per_model'].items():
+        metrics.observe(f'ensemble_{name}', result['compute_ms'] / 1000)
+    return {
+        'confidence': torch.sigmoid(output['logits']).item(),
+        'frames_used': frames.shape[0],
+        'queue_ms': 0.0,
+        'compute_ms': output['compute_ms'],
+        'per_model': {
+            name: {'confidence': torch.sigmoid(result['logits']).item(), 'compute_ms': result['compute_ms']}
+            for name, result in output['per_model'].items()
+        },
+    }
+
+def run_inference(filepath, video_hash=None, decoded=None, inline=False):
+    if ENSEMBLE:
+        return run_ensemble_inference(filepath, decoded, inline)
+    if STREAMING_INFERENCE:
+        return run_streaming_inference(filepath)
+
+    if not FEATURE_CACHE_DIR:
+        frames = load_frames(filepath, decoded)
+        # The worker adds the batch dimension and may share the forward pass with other uploads
+        inference = worker_predict(frames, inline)
+        record_worker_timings(inference)
+        inference['confidence'] = torch.sigmoid(inference.pop('output')).item()
+        inference['frames_used'] = frames.shape[0]
+        return inference
+
+    # A cache hit skips decoding and the backbone, only the LSTM head runs
+    video_hash = video_hash or content_hash(filepath)
+    feature_cache = get_feature_cache()
+    with metrics.span('feature_cache_lookup'):
+        # Short clips decode fewer than NUM_FRAMES frames, their features are stored under that count
+        cached_frames = min(feature_cache.frame_count(video_hash), NUM_FRAMES)
+        features = feature_cache.get(video_hash, cached_frames) if cached_frames else None
+    inference = {'queue_ms': 0.0, 'compute_ms': 0.0}
+    if features is None:
+        frames = load_frames(filepath, decoded)
+        inference.update(worker_predict(frames, inline))
+        record_worker_timings(inference)
+        features = inference['output']
+        with metrics.span('feature_cache_store'):
+            feature_cache.put(video_hash, features)
+
+    with metrics.span('classify'), torch.no_grad():
+        outputs = get_model().classify(features.unsqueeze(0))
+    inference['confidence'] = torch.sigmoid(outputs).item()
+    inference['frames_used'] = features.shape[0]
+    inference.pop('output', None)
+    return inference
+
+def cached_prediction(video_hash):
+    if prediction_cache is None:
+        return None
+    with metrics.span('prediction_cache_lookup'):
+        cached = prediction_cache.get(make_key(video_hash, get_checkpoint_hash(), sampling_key))
+    if cached is None:
+        return None
+    return dict(cached, queue_ms=0.0, compute_ms=0.0, cached=True)
+
+def predict_video(filepath, video_hash, decoded=None):
+    cached = cached_prediction(video_hash)
+    if cached is not None:
+        metrics.REQUESTS.inc(outcome='cached')
+        return cached
+
+    trace_name = profiler.sample('predict')
+    with profiler.profile(trace_name), metrics.span('inference_total'):
+        inference = run_inference(filepath, video_hash, decoded, inline=trace_name is not None)
+    metrics.REQUESTS.inc(outcome='predicted')
+    confidence_score = inference['confidence']
+    prediction = "Fake" if confidence_score > 0.5 else "Real"
+    result = {
+        "prediction": prediction,
+        "confidence": f"{confidence_score:.2%}",
+        "frames_used": inference['frames_used'],
+        "queue_ms": inference['queue_ms'],
+        "compute_ms": inference['compute_ms'],
+        "cached": False
+    }
+    if 'per_model' in inference:
+        result["per_model"] = inference['per_model']
+
+    if prediction_cache is not None:
+        prediction_cache.put(make_key(video_hash, get_checkpoint_hash(), sampling_key), {
+            "prediction": result["prediction"],
+            "confidence": result["confidence"],
+            "frames_used": result["frames_used"]
+        })
+    return result
+
+def run_job(payload):
+    upload, video_hash = payload
+    try:
+        return predict_video(upload.path, video_hash)
+    finally:
+        upload.close()
+
+job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    # Like the batching worker, the job threads are started in the serving process, forked workers have none
+    global job_queue
+    if job_queue is None:
+        with _job_queue_lock:
+            if job_queue is None:
+                job_queue = JobQueue(run_job, num_workers=JOB_WORKERS, max_queue_size=JOB_QUEUE_SIZE,
+                                     result_ttl=JOB_RESULT_TTL, db_path=JOB_DB or None)
+    return job_queue
+
+def submit_job(video_file):
+    video_hash = video_file.stream.hexdigest()
+
+    # Repeated uploads are answered right away instead of taking a worker
+    cached = cached_prediction(video_hash)
+    if cached is not None:
+        return jsonify({'job_id': None, 'status': 'done', 'result': cached, 'error': None})
+
+    # Every job holds its own reference to the upload, which outlives the request
+    upload = video_file.stream.keep()
+    try:
+        job_id = get_job_queue().submit((upload, video_hash))
+    except JobQueueFull as e:
+        # Backpressure: reject instead of letting the request time out behind the queue
+        upload.close()
+        metrics.REQUESTS.inc(outcome='rejected')
+        response = jsonify({'error': str(e), **get_job_queue().stats()})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response
+
+    return jsonify({'job_id': job_id, 'status': 'queued', 'result_url': url_for('result', job_id=job_id)}), 202
+
 @app.route('/')
 def home():
     return render_template_string(HTML_TEMPLATE, result=None, error=None)
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if 'videoFile' not in request.files:
+    # The body is parsed here, the upload is hashed into its spool as it arrives
+    with metrics.span('upload_receive'):
+        has_file = 'videoFile' in request.files
+    if not has_file:
         return render_template_string(HTML_TEMPLATE, result=None, error="No file part in the request.")
 
     video_file = request.files['videoFile']
@@ -57,24 +432,55 @@ def predict():
         return render_template_string(HTML_TEMPLATE, result=None, error="No selected file.")
 
     try:
-        filepath = os.path.join('uploads', video_file.filename)
-        video_file.save(filepath)
+        if ASYNC_JOBS or request.args.get('async') == '1':
+            return submit_job(video_file)
+
+        upload = video_file.stream
+        # Already hashed while it was received, so repeats can be answered from the cache
+        video_hash = upload.hexdigest()
+        with metrics.span('upload_decode_wait'):
+            decoded = upload.decoded_frames()
         
-        frames = load_and_preprocess_video(filepath)
-        frames = frames.unsqueeze(0)  # Add batch dimension
-        with torch.no_grad():
-            outputs = model(frames)
-            confidence_score = torch.sigmoid(outputs).item()
-            prediction = "Fake" if confidence_score > 0.5 else "Real"
-            result = {
-                "prediction": prediction,
-                "confidence": f"{confidence_score:.2%}"
-            }
+        result = predict_video(upload.path, video_hash, decoded)
         
         return render_template_string(HTML_TEMPLATE, result=result, error=None)
     
     except Exception as e:
+        metrics.REQUESTS.inc(outcome='error')
         return render_template_string(HTML_TEMPLATE, result=None, error=str(e))
 
+@app.route('/result/<job_id>')
+def result(job_id):
+    # Jobs submitted to other worker processes are found through the shared JOB_DB
+    job = get_job_queue().get(job_id) if JOB_DB or job_queue is not None else None
+    if job is None:
+        return jsonify({'error': "Unknown or expired job ID"}), 404
+    return jsonify({'job_id': job_id, 'status': job['status'], 'result': job['result'], 'error': job['error']})
+
+@app.route('/jobs/stats')
+def job_stats():
+    if job_queue is None:
+        return jsonify({'started': False})
+    return jsonify(job_queue.stats())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(prediction_cache.stats() if prediction_cache is not None else {'enabled': False})
+
+@app.route('/inference_stats')
+def inference_stats():
+    if inference_worker is None:
+        return jsonify({'started': False})
+    return jsonify(inference_worker.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/model_stats')
+def model_stats():
+    # Memory is per worker process, shared_mb includes weights shared with the other workers
+    return jsonify({'startup_seconds': startup_seconds, 'pid': os.getpid(), **model_registry.stats()})
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,44 @@
+import torch
+
+# Top-level stages of a torchvision ResNet/ResNeXt, in forward order
+RESNET_STAGES = ('conv1', 'bn1', 'relu', 'maxpool', 'layer1', 'layer2', 'layer3', 'layer4', 'avgpool', 'fc')
+
+def trainable_split(backbone):
+    """
+    Returns the index of the first stage with a trainable parameter.
+
+    Stages before it form the frozen trunk, the rest is the trainable tail. A fully
+    frozen backbone returns len(RESNET_STAGES), so the tail is empty.
+    """
+    for i, name in enumerate(RESNET_STAGES):
+        if any(param.requires_grad for param in getattr(backbone, name).parameters()):
+            return i
+    return len(RESNET_STAGES)
+
+def _run_stages(backbone, x, stages):
+    for name in stages:
+        if name == 'fc':
+            x = torch.flatten(x, 1)
+        x = getattr(backbone, name)(x)
+    return x
+
+def forward_backbone(backbone, x, channels_last=False):
+    """
+    Runs a ResNet/ResNeXt backbone with the frozen trunk outside of autograd.
+
+    The trunk has no trainable parameters, so no activations are kept for it and the
+    gradients of the tail are the same as with a plain backbone(x) call. no_grad is used
+    rather than inference_mode because the trunk output still feeds modules that need grad.
+
+    Args:
+        backbone (nn.Module): torchvision ResNet or ResNeXt.
+        x (Tensor): Images of shape (N, 3, H, W).
+        channels_last (bool): Run the convolutions on NHWC tensors.
+    """
+    if channels_last:
+        x = x.contiguous(memory_format=torch.channels_last)
+
+    split = trainable_split(backbone)
+    with torch.no_grad():
+        x = _run_stages(backbone, x, RESNET_STAGES[:split])
+    return _run_stages(backbone, x, RESNET_STAGES[split:])
@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from data_preprocessing import decode_frames, extract_frames, load_and_preprocess_video
+from dataloader import SyntheticClips, write_synthetic_frame_tree, write_video
+from frame_sampling import sample_diversity, sample_frames
+from dataset import DeepFakeDataset
+from ensemble import EnsembleDetector
+from export_model import ARCHITECTURES, build_model, export_torchscript
+from train import feature_transform, train_labels, validate
+
+STAGES = ('extract_frames', 'load_and_preprocess_video', 'frame_sampling', 'dataset_getitem', 'face_crop',
+          'model_forward', 'ensemble_forward', 'http_predict')
+
+def time_calls(fn, repeats=10, warmup=2):
+    """Returns the wall-clock time of each call to fn in milliseconds, after warmup calls."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def summarize(stage, params, timings, items_per_call=1):
+    ordered = np.sort(np.asarray(timings))
+    mean_ms = float(ordered.mean())
+    result = {
+        'stage': stage,
+        'params': params,
+        'p50_ms': float(np.percentile(ordered, 50)),
+        'p90_ms': float(np.percentile(ordered, 90)),
+        'p99_ms': float(np.percentile(ordered, 99)),
+        'mean_ms': mean_ms,
+        'throughput_per_sec': items_per_call * 1000 / mean_ms if mean_ms > 0 else 0.0,
+    }
+    print(f"{stage:<26} {json.dumps(params):<60} p50 {result['p50_ms']:9.2f} ms  "
+          f"p99 {result['p99_ms']:9.2f} ms  {result['throughput_per_sec']:9.2f}/s")
+    return result
+
+def bench_extract_frames(video_path, work_dir, frame_counts, repeats):
+    results = []
+    output_dir = os.path.join(work_dir, 'extracted')
+    os.makedirs(output_dir, exist_ok=True)
+    for num_frames in frame_counts:
+        timings = time_calls(lambda: extract_frames(video_path, output_dir, num_frames=num_frames), repeats)
+        results.append(summarize('extract_frames', {'num_frames': num_frames}, timings))
+    return results
+
+def bench_load_and_preprocess(video_path, frame_counts, repeats):
+    results = []
+    for num_frames in frame_counts:
+        timings = time_calls(lambda: load_and_preprocess_video(video_path, num_frames=num_frames), repeats)
+        results.append(summarize('load_and_preprocess_video', {'num_frames': num_frames}, timings))
+    return results
+
+def bench_frame_sampling(video_path, frame_counts, repeats):
+    """Compares fixed-interval seeking with adaptive sampling on decode time and the diversity of the frames."""
+    results = []
+    for num_frames in frame_counts:
+        timings = time_calls(lambda: decode_frames(video_path, num_frames=num_frames), repeats)
+        result = summarize('frame_sampling', {'method': 'fixed_interval', 'num_frames': num_frames}, timings)
+        result['diversity'] = sample_diversity(decode_frames(video_path, num_frames=num_frames))
+        results.append(result)
+
+        timings = time_calls(lambda: sample_frames(video_path, num_frames=num_frames), repeats)
+        result = summarize('frame_sampling', {'method': 'adaptive', 'num_frames': num_frames}, timings)
+        result['diversity'] = sample_frames(video_path, num_frames=num_frames)[1]['diversity']
+        results.append(result)
+        print(f"{'':<26} diversity: fixed_interval {results[-2]['diversity']:.3f}, adaptive {result['diversity']:.3f}")
+    return results
+
+def bench_dataset_getitem(frames_dir, frame_counts, repeats):
+    results = []
+    for num_frames in frame_counts:
+        dataset = DeepFakeDataset(frames_dir=frames_dir, labels=train_labels, transform=feature_transform,
+                                  num_frames=num_frames)
+        if len(dataset) == 0:
+            continue
+        indices = iter(np.random.default_rng(0).integers(0, len(dataset), repeats + 2))
+        timings = time_calls(lambda: dataset[int(next(indices))], repeats)
+        results.append(summarize('dataset_getitem', {'num_frames': num_frames}, timings))
+    return results
+
+def bench_face_crop(video_path, frames_dir, frame_counts, repeats):
+    """Times the serve path (decode + detect + crop) and the train path (cached boxes) against full frames."""
+    results = []
+    for num_frames in frame_counts:
+        for face_crop in (False, True):
+            timings = time_calls(lambda: load_and_preprocess_video(video_path, num_frames=num_frames,
+                                                                   face_crop=face_crop), repeats)
+            results.append(summarize('face_crop', {'path': 'serve', 'num_frames': num_frames, 'face_crop': face_crop},
+                                     timings))
+
+            # Building the dataset detects and caches the boxes, so only the crop is timed per item
+            dataset = DeepFakeDataset(frames_dir=frames_dir, labels=train_labels, transform=feature_transform,
+                                      num_frames=num_frames, face_crop=face_crop)
+            if len(dataset) == 0:
+                continue
+            indices = iter(np.random.default_rng(0).integers(0, len(dataset), repeats + 2))
+            timings = time_calls(lambda: dataset[int(next(indices))], repeats)
+            results.append(summarize('face_crop', {'path': 'train', 'num_frames': num_frames, 'face_crop': face_crop},
+                                     timings))
+    return results
+
+def compare_face_crop_accuracy(frames_dir, arch, checkpoint, face_checkpoint=None, num_frames=10, batch_size=8):
+    """
+    Validates full-frame and face-crop input on a labelled frames tree.
+
+    A model trained on face crops should be passed as `face_checkpoint`, the full-frame
+    `checkpoint` is used for both when it is not given.
+
+    Returns:
+        list: Accuracy, loss and videos/sec of each input mode.
+    """
+    results = []
+    for face_crop, weights in ((False, checkpoint), (True, face_checkpoint or checkpoint)):
+        model = build_model(arch, weights)
+        dataset = DeepFakeDataset(frames_dir=frames_dir, labels=train_labels, transform=feature_transform,
+                                  num_frames=num_frames, face_crop=face_crop)
+        loader = DataLoader(dataset, batch_size=batch_size)
+        start = time.perf_counter()
+        loss, accuracy = validate(model, loader, nn.BCEWithLogitsLoss(), torch.device('cpu'))
+        elapsed = time.perf_counter() - start
+        result = {'face_crop': face_crop, 'checkpoint': weights, 'accuracy': accuracy, 'loss': loss,
+                  'videos_per_sec': len(dataset) / elapsed if elapsed > 0 else 0.0}
+        print(f"face_crop={face_crop}: accuracy {accuracy:.2f}%, loss {loss:.4f}, "
+              f"{result['videos_per_sec']:.2f} videos/sec")
+        results.append(result)
+    return results
+
+def bench_model_forward(backbones, batch_sizes, frame_counts, thread_counts, repeats):
+    results = []
+    default_threads = torch.get_num_threads()
+    for arch in backbones:
+        model = build_model(arch)
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                for num_frames in frame_counts:
+                    frames = torch.randn(batch_size, num_frames, 3, 224, 224)
+                    with torch.no_grad():
+                        timings = time_calls(lambda: model(frames), repeats)
+                    params = {'backbone': arch, 'batch_size': batch_size, 'num_frames': num_frames, 'threads': threads}
+                    results.append(summarize('model_forward', params, timings, items_per_call=batch_size))
+    torch.set_num_threads(default_threads)
+    return results
+
+def bench_ensemble_forward(frame_counts, repeats):
+    """Compares each detector alone, both run back to back, and the concurrent ensemble on one clip."""
+    results = []
+    models = {arch: build_model(arch) for arch in ('resnet', 'resnext')}
+    ensemble = EnsembleDetector(models)
+    for num_frames in frame_counts:
+        frames = torch.randn(1, num_frames, 3, 224, 224)
+        with torch.no_grad():
+            for arch, model in models.items():
+                timings = time_calls(lambda: model(frames), repeats)
+                results.append(summarize('ensemble_forward', {'mode': arch, 'num_frames': num_frames}, timings))
+            timings = time_calls(lambda: [model(frames) for model in models.values()], repeats)
+            results.append(summarize('ensemble_forward', {'mode': 'sequential', 'num_frames': num_frames}, timings))
+        timings = time_calls(lambda: ensemble.predict(frames), repeats)
+        results.append(summarize('ensemble_forward', {'mode': 'concurrent', 'num_frames': num_frames}, timings))
+    return results
+
+def bench_http_predict(video_path, work_dir, repeats):
+    # Serve a freshly exported model so app.py does not need a trained checkpoint on disk
+    artifact = os.path.join(work_dir, 'bench_model.pt')
+    export_torchscript(build_model('resnet'), artifact)
+    os.environ['MODEL_ARTIFACT'] = artifact
+    # The same clip is posted every call, cache hits would skip the decode and inference being measured
+    os.environ['PREDICTION_CACHE_SIZE'] = '0'
+
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import app as app_module
+        client = app_module.app.test_client()
+
+        def post():
+            with open(video_path, 'rb') as f:
+                response = client.post('/predict', data={'videoFile': (f, 'bench.mp4')},
+                                       content_type='multipart/form-data')
+            assert response.status_code == 200, response.status_code
+
+        timings = time_calls(post, repeats)
+    finally:
+        os.chdir(previous_dir)
+    return [summarize('http_predict', {'model': 'resnet', 'format': 'torchscript'}, timings)]
+
+def environment_info():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cuda': torch.cuda.is_available(),
+    }
+
+def compare_results(baseline_path, current, threshold=0.10):
+    """
+    Compares p50 latencies with a saved run and returns the stages that got slower.
+
+    A result regresses when its p50 grew by more than `threshold` (a fraction) over the
+    baseline result with the same stage and parameters.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    baseline_p50 = {(r['stage'], json.dumps(r['params'], sort_keys=True)): r['p50_ms'] for r in baseline['results']}
+
+    regressions = []
+    for result in current['results']:
+        key = (result['stage'], json.dumps(result['params'], sort_keys=True))
+        if key not in baseline_p50:
+            continue
+        change = result['p50_ms'] / baseline_p50[key] - 1
+        if change > threshold:
+            regressions.append({'stage': result['stage'], 'params': result['params'],
+                                'baseline_p50_ms': baseline_p50[key], 'p50_ms': result['p50_ms'], 'change': change})
+            print(f"REGRESSION {result['stage']} {json.dumps(result['params'])}: "
+                  f"{baseline_p50[key]:.2f} -> {result['p50_ms']:.2f} ms ({change:+.1%})")
+    return regressions
+
+def run_benchmarks(stages, backbones, batch_sizes, frame_counts, thread_counts, repeats, video_frames=90):
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The same seeded clips as dataloader.py's synthetic dataset, one 360p clip encoded to a real file
+        clip, _ = SyntheticClips(size=1, num_frames=video_frames, height=360, width=640)[0]
+        video_path = write_video(os.path.join(work_dir, 'synthetic.mp4'), clip)
+        frames_dir = os.path.join(work_dir, 'frames')
+        write_synthetic_frame_tree(SyntheticClips(size=8, num_frames=max(frame_counts)), frames_dir)
+
+        if 'extract_frames' in stages:
+            results += bench_extract_frames(video_path, work_dir, frame_counts, repeats)
+        if 'load_and_preprocess_video' in stages:
+            results += bench_load_and_preprocess(video_path, frame_counts, repeats)
+        if 'frame_sampling' in stages:
+            results += bench_frame_sampling(video_path, frame_counts, repeats)
+        if 'dataset_getitem' in stages:
+            results += bench_dataset_getitem(frames_dir, frame_counts, repeats)
+        if 'face_crop' in stages:
+            results += bench_face_crop(video_path, frames_dir, frame_counts, repeats)
+        if 'model_forward' in stages:
+            results += bench_model_forward(backbones, batch_sizes, frame_counts, thread_counts, repeats)
+        if 'ensemble_forward' in stages:
+            results += bench_ensemble_forward(frame_counts, repeats)
+        if 'http_predict' in stages:
+            results += bench_http_predict(video_path, work_dir, repeats)
+
+    return {'environment': environment_info(), 'results': results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage-by-stage latency and throughput benchmarks")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--backbones', nargs='+', choices=sorted(ARCHITECTURES), default=sorted(ARCHITECTURES))
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--frame-counts', nargs='+', type=int, default=[10])
+    parser.add_argument('--threads', nargs='+', type=int, default=[torch.get_num_threads()])
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed p50 slowdown before flagging")
+    parser.add_argument('--accuracy-frames-dir', help="Labelled real/fake frames tree to compare face-crop accuracy on")
+    parser.add_argument('--accuracy-arch', choices=sorted(ARCHITECTURES), default='resnext')
+    parser.add_argument('--checkpoint', help="Detector trained on full frames, for the accuracy comparison")
+    parser.add_argument('--face-checkpoint', help="Detector trained on face crops (default: --checkpoint)")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.stages, args.backbones, args.batch_sizes, args.frame_counts, args.threads, args.repeats)
+    if args.accuracy_frames_dir:
+        report['face_crop_accuracy'] = compare_face_crop_accuracy(
+            args.accuracy_frames_dir, args.accuracy_arch, args.checkpoint, args.face_checkpoint,
+            num_frames=max(args.frame_counts)
+        )
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, report, threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,77 @@
+import os
+import random
+
+import numpy as np
+import torch
+
+def atomic_save(obj, path):
+    """Saves with torch.save to a temporary file and renames it, so a crash never leaves a partial file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def _rng_state():
+    return {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+def _set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def save_checkpoint(path, model, optimizer, scheduler, scaler, epoch, best_val_loss, epochs_without_improvement):
+    """
+    Atomically writes everything needed to resume training after `epoch` (0-based) has finished.
+    """
+    atomic_save({
+        'epoch': epoch,
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict(),
+        'scaler': scaler.state_dict(),
+        'best_val_loss': best_val_loss,
+        'epochs_without_improvement': epochs_without_improvement,
+        'rng': _rng_state(),
+    }, path)
+
+def read_progress(path):
+    """
+    Returns the `epoch`, `best_val_loss` and `epochs_without_improvement` of a checkpoint
+    without restoring anything.
+    """
+    state = torch.load(path, map_location='cpu', weights_only=False)
+    return {
+        'epoch': state['epoch'],
+        'best_val_loss': state['best_val_loss'],
+        'epochs_without_improvement': state['epochs_without_improvement'],
+    }
+
+def load_checkpoint(path, model, optimizer, scheduler, scaler):
+    """
+    Restores model, optimizer, scheduler, scaler and RNG state from a checkpoint.
+
+    Returns:
+        dict: The `epoch` that was finished, `best_val_loss` and `epochs_without_improvement`.
+    """
+    # Loaded on the CPU because RNG states must be CPU tensors, load_state_dict moves the rest.
+    # The checkpoint holds Python and NumPy RNG state, which needs the full unpickler
+    state = torch.load(path, map_location='cpu', weights_only=False)
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scheduler.load_state_dict(state['scheduler'])
+    scaler.load_state_dict(state['scaler'])
+    _set_rng_state(state['rng'])
+    return {
+        'epoch': state['epoch'],
+        'best_val_loss': state['best_val_loss'],
+        'epochs_without_improvement': state['epochs_without_improvement'],
+    }
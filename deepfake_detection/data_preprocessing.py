@@ -1,24 +1,42 @@
 import cv2
 import os
+import time
+import numpy as np
 import torch
-from torchvision import transforms
 
-def extract_frames(filepath, output_dir, num_frames=10):
+import metrics
+from face_crop import FaceTracker, crop_frames, detect_face_boxes
+from frame_sampling import DETAIL_FRAME_HEIGHT, MODEL_FRAME_HEIGHT, sample_frames
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+def _sample_positions(total_frames, num_frames):
+    # Same fixed-interval sampling that extract_frames has always used
+    frame_interval = max(total_frames // num_frames, 1)
+    return [min(i * frame_interval, total_frames - 1) for i in range(num_frames)]
+
+def extract_frames(filepath, output_dir, num_frames=10, adaptive=False):
+    if adaptive:
+        # One sequential pass keeping the most informative frames, see frame_sampling.sample_frames
+        frames, _ = sample_frames(filepath, num_frames=num_frames, frame_height=DETAIL_FRAME_HEIGHT)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(output_dir, f'frame_{i:05d}.jpg'), frame)
+        return
+
     cap = cv2.VideoCapture(filepath)
     if not cap.isOpened():
         raise ValueError("Failed to open video file")
     
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_interval = max(total_frames // num_frames, 1)
-    
+
     frames_extracted = 0
-    for i in range(num_frames):
-        frame_pos = min(i * frame_interval, total_frames - 1)
+    for i, frame_pos in enumerate(_sample_positions(total_frames, num_frames)):
         cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
         ret, frame = cap.read()
         
         if ret:
-            output_path = os.path.join(output_dir, f'frame_{i}.jpg')
+            output_path = os.path.join(output_dir, f'frame_{i:05d}.jpg')
             cv2.imwrite(output_path, frame)
             frames_extracted += 1
     
@@ -26,40 +44,181 @@ def extract_frames(filepath, output_dir, num_frames=10):
     if frames_extracted == 0:
         raise ValueError("No frames were extracted from the video")
 
-def load_and_preprocess_video(filepath):
-    temp_frames_dir = os.path.join('uploads', 'temp_frames')
-    os.makedirs(temp_frames_dir, exist_ok=True)
+def decode_frames(filepath, num_frames=10):
+    """
+    Decodes the sampled frames of a video into a single uint8 buffer.
+
+    Args:
+        filepath (str): Path to the video file.
+        num_frames (int): Number of frames to sample from the video.
+
+    Returns:
+        np.ndarray: A uint8 array of shape (frames_decoded, height, width, 3) in BGR order.
+    """
+    cap = cv2.VideoCapture(filepath)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video file")
 
+    seek_seconds = 0.0
+    retrieve_seconds = 0.0
     try:
-        extract_frames(filepath, temp_frames_dir, num_frames=10)
-        
-        processed_frames = []
-        transform = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225]
-            )
-        ])
-        
-        for i in range(10):
-            frame_path = os.path.join(temp_frames_dir, f'frame_{i}.jpg')
-            frame = cv2.imread(frame_path)
-            if frame is None:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        buffer = None
+        frames_decoded = 0
+        for frame_pos in _sample_positions(total_frames, num_frames):
+            started = time.perf_counter()
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
+            grabbed = cap.grab()
+            seek_seconds += time.perf_counter() - started
+            if not grabbed:
                 continue
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = transform(frame)
-            processed_frames.append(frame)
 
-        if not processed_frames:
-            raise ValueError("No frames were successfully processed")
-        
-        frames_tensor = torch.stack(processed_frames)
-        return frames_tensor
-        
+            started = time.perf_counter()
+            if buffer is None:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    continue
+                # Allocate once from the first decoded frame, later frames decode in place
+                buffer = np.empty((num_frames,) + frame.shape, dtype=np.uint8)
+                buffer[0] = frame
+                frames_decoded = 1
+                retrieve_seconds += time.perf_counter() - started
+                continue
+
+            slot = buffer[frames_decoded]
+            ret, frame = cap.retrieve(slot)
+            if ret and frame.ctypes.data != slot.ctypes.data:
+                # OpenCV decoded into a new array (the frame size or layout changed), copy it into the slot
+                slot[...] = frame if frame.shape == slot.shape else cv2.resize(frame, (slot.shape[1], slot.shape[0]))
+            retrieve_seconds += time.perf_counter() - started
+            if ret:
+                frames_decoded += 1
     finally:
-        for file in os.listdir(temp_frames_dir):
-            os.remove(os.path.join(temp_frames_dir, file))
-        os.rmdir(temp_frames_dir) 
\ No newline at end of file
+        cap.release()
+        # Seeking (set + grab) and converting the decoded frame (retrieve) are reported separately
+        metrics.observe('decode_seek', seek_seconds)
+        metrics.observe('decode_retrieve', retrieve_seconds)
+
+    if frames_decoded == 0:
+        raise ValueError("No frames were extracted from the video")
+
+    return buffer[:frames_decoded]
+
+def read_frames_sequential(filepath, num_frames=10):
+    """
+    Decodes a video in one sequential pass and keeps only the sampled frames.
+
+    Skipped frames are grabbed without being converted, which avoids decoding from the
+    previous keyframe for every sample the way seeking does.
+
+    Returns:
+        list: The sampled frames as BGR uint8 arrays.
+    """
+    cap = cv2.VideoCapture(filepath)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video file")
+
+    frames = []
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Duplicate positions (videos shorter than num_frames) are only decoded once
+        wanted = sorted(set(_sample_positions(total_frames, num_frames)))
+        position = 0
+        for frame_pos in wanted:
+            while position < frame_pos and cap.grab():
+                position += 1
+            ret, frame = cap.read() if position == frame_pos else (False, None)
+            if not ret:
+                break
+            frames.append(frame)
+            position += 1
+    finally:
+        cap.release()
+
+    if not frames:
+        raise ValueError("No frames were extracted from the video")
+
+    return frames
+
+def preprocess_frames(frames, size=(224, 224)):
+    """
+    Resizes, converts BGR to RGB and normalizes a batch of frames in one tensor operation.
+
+    Args:
+        frames (np.ndarray): A uint8 array of shape (num_frames, height, width, 3) in BGR order.
+        size (tuple): Output (height, width) of every frame.
+
+    Returns:
+        Tensor: A float tensor of shape (num_frames, 3, height, width).
+    """
+    if tuple(frames.shape[1:3]) != tuple(size):
+        # Resized while still uint8, a float copy of 10 full-resolution 1080p frames alone takes 250 MB
+        resized = np.empty((len(frames), size[0], size[1], 3), dtype=np.uint8)
+        for i, frame in enumerate(frames):
+            resized[i] = cv2.resize(frame, (size[1], size[0]), interpolation=cv2.INTER_AREA)
+        frames = resized
+
+    # (N, H, W, C) BGR -> (N, C, H, W) RGB, flipping the channel axis on the uint8 data
+    frames_tensor = torch.from_numpy(frames).permute(0, 3, 1, 2).flip(1).float().div_(255.0)
+
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return frames_tensor.sub_(mean).div_(std).contiguous()
+
+def iter_frame_chunks(filepath, chunk_size=4, sample_fps=2.0, max_frames=64, face_crop=False):
+    """
+    Decodes a video sequentially and yields preprocessed chunks of frames.
+
+    Frames are sampled at `sample_fps` frames per second of video rather than at a fixed
+    count, and decoding stops after `max_frames` sampled frames or when the caller stops
+    iterating, so memory and time stay bounded for long videos. With `face_crop` every
+    frame is cropped to the tracked face, frames before the face is first found stay whole.
+
+    Yields:
+        Tensor: Chunks of shape (frames_in_chunk, 3, 224, 224).
+    """
+    cap = cv2.VideoCapture(filepath)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video file")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_stride = max(int(round(fps / sample_fps)), 1) if fps > 0 else 1
+
+        tracker = FaceTracker() if face_crop else None
+        chunk = []
+        sampled = 0
+        position = 0
+        while sampled < max_frames and cap.grab():
+            if position % frame_stride == 0:
+                ret, frame = cap.retrieve()
+                if ret:
+                    if tracker is not None:
+                        frame = crop_frames([frame], [tracker.update(frame)])[0]
+                    chunk.append(frame)
+                    sampled += 1
+                    if len(chunk) == chunk_size:
+                        yield preprocess_frames(np.stack(chunk))
+                        chunk = []
+            position += 1
+
+        if chunk:
+            yield preprocess_frames(np.stack(chunk))
+        elif sampled == 0:
+            raise ValueError("No frames were extracted from the video")
+    finally:
+        cap.release()
+
+def load_and_preprocess_video(filepath, num_frames=10, face_crop=False, adaptive=False):
+    with metrics.span('decode'):
+        if adaptive:
+            # Face crops are cut from the sampled frames, so they keep more than the model's 224 pixels
+            frames, _ = sample_frames(filepath, num_frames=num_frames,
+                                      frame_height=DETAIL_FRAME_HEIGHT if face_crop else MODEL_FRAME_HEIGHT)
+        else:
+            frames = decode_frames(filepath, num_frames=num_frames)
+    if face_crop:
+        with metrics.span('face_crop'):
+            frames = crop_frames(frames, detect_face_boxes(frames))
+    with metrics.span('preprocess'):
+        return preprocess_frames(frames)
@@ -1,4 +1,6 @@
+import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import torch
@@ -6,11 +8,89 @@ from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
 from PIL import Image
 
+LABEL_NAMES = ('real', 'fake')
+
+class SyntheticClips:
+    """
+    Sequence of (frames, label) random clips that are generated when they are read.
+
+    Every clip comes from a random generator seeded with (seed, index), so a clip is the same
+    in every run and in every DataLoader worker, and memory does not grow with `size`.
+    """
+
+    def __init__(self, size=100, num_frames=10, height=224, width=224, seed=0):
+        self.size = size
+        self.num_frames = num_frames
+        self.height = height
+        self.width = width
+        self.seed = seed
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.size:
+            raise IndexError(f"Clip index {idx} out of range for {self.size} clips")
+        rng = np.random.default_rng([self.seed, idx])
+        frames = rng.integers(0, 256, (self.num_frames, self.height, self.width, 3), dtype=np.uint8)
+        label = idx % 2  # Alternating between real (0) and fake (1)
+        return frames, label
+
+def _write_clips(clips, write_clip, num_workers, chunk_size=1024):
+    # cv2 encoding releases the GIL, so threads write clips in parallel. Clips are submitted
+    # in chunks so the pending futures stay bounded for very large datasets
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for start in range(0, len(clips), chunk_size):
+            indices = range(start, min(start + chunk_size, len(clips)))
+            list(executor.map(lambda idx: write_clip(idx, *clips[idx]), indices))
+
+def write_video(path, frames, fps=30):
+    """Encodes a (num_frames, height, width, 3) BGR clip to an mp4 file and returns its path."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frames.shape[2], frames.shape[1]))
+    if not writer.isOpened():
+        raise RuntimeError(f"Failed to open a video writer for {path}")
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return path
+
+def write_synthetic_videos(clips, output_dir, fps=30, num_workers=8):
+    """Encodes every clip to output_dir/<real|fake>/clip_<index>.mp4, the layout extract_corpus.py reads."""
+    def write_clip(idx, frames, label):
+        label_dir = os.path.join(output_dir, LABEL_NAMES[label])
+        os.makedirs(label_dir, exist_ok=True)
+        write_video(os.path.join(label_dir, f'clip_{idx:07d}.mp4'), frames, fps)
+
+    _write_clips(clips, write_clip, num_workers)
+
+def write_synthetic_frame_tree(clips, output_dir, num_workers=8):
+    """Writes every clip to output_dir/<real|fake>/clip_<index>/frame_*.jpg, the layout dataset.DeepFakeDataset reads."""
+    def write_clip(idx, frames, label):
+        clip_dir = os.path.join(output_dir, LABEL_NAMES[label], f'clip_{idx:07d}')
+        os.makedirs(clip_dir, exist_ok=True)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(clip_dir, f'frame_{i:05d}.jpg'), frame)
+
+    _write_clips(clips, write_clip, num_workers)
+
 class DeepFakeDataset(Dataset):
-    def __init__(self, frames_dir, transform=None, num_frames=10):
+    def __init__(self, frames_dir, transform=None, num_frames=10, synthetic_size=100, resolution=(224, 224),
+                 seed=0):
+        """
+        Args:
+            frames_dir (str): Path to the directory containing the video frames.
+            transform (callable, optional): A function/transform to apply to the frames.
+            num_frames (int): Number of frames per clip.
+            synthetic_size (int): Number of synthetic clips used when frames_dir does not exist.
+            resolution (tuple): (height, width) of the synthetic frames.
+            seed (int): Seed the synthetic clips are derived from.
+        """
         self.frames_dir = frames_dir
         self.transform = transform
         self.num_frames = num_frames
+        self.synthetic_size = synthetic_size
+        self.resolution = resolution
+        self.seed = seed
         self.data = self._load_data()
 
     def _load_data(self):
@@ -24,14 +104,14 @@ class DeepFakeDataset(Dataset):
         return data
 
     def _create_dummy_data(self):
-        dummy_data = []
-        for idx in range(100):
-            frames = np.random.randint(
-                0, 255, (self.num_frames, 224, 224, 3), dtype=np.uint8
-            )
-            label = idx % 2  # Alternating between real (0) and fake (1)
-            dummy_data.append((frames, label))
-        return dummy_data
+        # Clips are generated on demand, so workers only pickle the generator's parameters
+        return SyntheticClips(
+            size=self.synthetic_size,
+            num_frames=self.num_frames,
+            height=self.resolution[0],
+            width=self.resolution[1],
+            seed=self.seed
+        )
 
     def __len__(self):
         return len(self.data)
@@ -42,9 +122,11 @@ class DeepFakeDataset(Dataset):
         # Transform each frame individually if transform is set
         if self.transform:
             frames = [self.transform(Image.fromarray(frame)) for frame in frames]
-
-        # Stack transformed frames along a new dimension to create a tensor
-        frames_tensor = torch.stack(frames)
+            # Stack transformed frames along a new dimension to create a tensor
+            frames_tensor = torch.stack(frames)
+        else:
+            # (num_frames, H, W, 3) uint8 -> (num_frames, 3, H, W) in [0, 1], like ToTensor
+            frames_tensor = torch.from_numpy(frames).permute(0, 3, 1, 2).float().div_(255.0)
         
         return frames_tensor, torch.tensor(label, dtype=torch.float32)
 
@@ -76,13 +158,36 @@ def initialize_data_loaders(data_dir, batch_size=32, num_frames=10):
     return train_loader, val_loader, test_loader
 
 if __name__ == "__main__":
-    data_dir = "E:/Project/Deepfake detection/data/frames"
+    parser = argparse.ArgumentParser(description="Inspect the dataset, or write synthetic clips for load tests")
+    parser.add_argument('--data-dir', default="E:/Project/Deepfake detection/data/frames")
+    parser.add_argument('--size', type=int, default=100, help="Number of synthetic clips")
+    parser.add_argument('--num-frames', type=int, default=10)
+    parser.add_argument('--height', type=int, default=224)
+    parser.add_argument('--width', type=int, default=224)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-videos', help="Encode the synthetic clips as .mp4 files under this directory")
+    parser.add_argument('--write-frames', help="Write the synthetic clips as a JPEG frame tree under this directory")
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    clips = SyntheticClips(args.size, args.num_frames, args.height, args.width, args.seed)
+    if args.write_videos:
+        write_synthetic_videos(clips, args.write_videos, num_workers=args.workers)
+        print(f"Wrote {len(clips)} synthetic videos to {args.write_videos}")
+    if args.write_frames:
+        write_synthetic_frame_tree(clips, args.write_frames, num_workers=args.workers)
+        print(f"Wrote {len(clips)} synthetic frame folders to {args.write_frames}")
+    if args.write_videos or args.write_frames:
+        raise SystemExit(0)
+
+    data_dir = args.data_dir
 
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
         print(f"Created directory: {data_dir}")
 
-    dataset = DeepFakeDataset(frames_dir=data_dir)
+    dataset = DeepFakeDataset(frames_dir=data_dir, num_frames=args.num_frames, synthetic_size=args.size,
+                              resolution=(args.height, args.width), seed=args.seed)
     print(f"Dataset size: {len(dataset)}")
 
     frames, label = dataset[0]
@@ -1,66 +1,252 @@
+import json
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import Dataset
 from PIL import Image
 from torchvision import transforms
+import cv2
 import torch
+from face_crop import detect_face_boxes
+from feature_cache import frames_hash
+
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png')  # Image file extensions
+SCRATCH_SUFFIX = '.partial'  # Folders extract_corpus.py is still writing, or left by a killed run
+MANIFEST_NAME = '.deepfake_manifest.json'
+MANIFEST_VERSION = 1
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get('videos', {}) if manifest.get('version') == MANIFEST_VERSION else {}
+
+def _write_manifest(manifest_path, videos):
+    # A temporary file of its own, so processes writing the manifest at once never interleave
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(manifest_path) + '.',
+                                        dir=os.path.dirname(manifest_path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'videos': videos}, f)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        # A read-only frames tree still works, it is just rescanned every time
+        print(f"Could not write manifest {manifest_path}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _scan_frames(video_path):
+    with os.scandir(video_path) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.name.lower().endswith(VALID_EXTENSIONS) and entry.is_file())
+
+def index_videos(frames_dir, labels, manifest_path=None, num_workers=16):
+    """
+    Indexes every video folder under the `real`/`fake` directories, using a cached manifest.
+
+    A video folder is only listed again when its mtime differs from the one recorded in the
+    manifest, so warm starts cost one stat per video (done in parallel) instead of a listing.
+
+    Args:
+        frames_dir (str): Path to the directory containing the video frames.
+        labels (dict): Dictionary containing labels for 'real' and 'fake' videos.
+        manifest_path (str, optional): Manifest location, defaults to a file inside frames_dir.
+        num_workers (int): Threads used to stat and list the video folders.
+
+    Returns:
+        tuple: (videos, manifest_path) where videos maps '<label>/<video>' to its manifest entry,
+            a dict holding the folder `mtime_ns` and its sorted `frames`.
+    """
+    manifest_path = manifest_path or os.path.join(frames_dir, MANIFEST_NAME)
+    cached = _read_manifest(manifest_path)
+
+    video_dirs = []
+    for label_name in labels:
+        label_dir = os.path.join(frames_dir, label_name)
+        if not os.path.isdir(label_dir):
+            continue
+        with os.scandir(label_dir) as entries:
+            video_dirs.extend((f"{label_name}/{entry.name}", entry.path) for entry in entries
+                              if entry.is_dir() and not entry.name.endswith(SCRATCH_SUFFIX))
+
+    def refresh(video):
+        key, path = video
+        mtime_ns = os.stat(path).st_mtime_ns
+        entry = cached.get(key)
+        if entry is not None and entry['mtime_ns'] == mtime_ns:
+            return key, entry, False
+        return key, {'mtime_ns': mtime_ns, 'frames': _scan_frames(path)}, True
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(refresh, video_dirs))
+
+    videos = {key: entry for key, entry, _ in results}
+    rescanned = sum(changed for _, _, changed in results)
+    if rescanned or len(videos) != len(cached):
+        _write_manifest(manifest_path, videos)
+    return videos, manifest_path
+
+def cache_face_boxes(frames_dir, videos, video_frames, manifest_path, num_workers=16):
+    """
+    Detects the face boxes of the given frames and stores them in the videos' manifest entries.
+
+    Boxes are kept under each entry's `faces`, keyed by frame name, so they are only detected
+    once per video and are dropped with the rest of the entry when the folder changes.
+
+    Args:
+        frames_dir (str): Path to the directory containing the video frames.
+        videos (dict): Manifest entries returned by index_videos, updated in place.
+        video_frames (dict): Maps '<label>/<video>' to the frame names that need a box.
+        manifest_path (str): Manifest to rewrite when boxes were added.
+        num_workers (int): Threads used to detect faces (OpenCV releases the GIL).
+    """
+    missing = [key for key, names in video_frames.items()
+               if any(name not in videos[key].get('faces', {}) for name in names)]
+    if not missing:
+        return
+
+    def detect(key):
+        names = video_frames[key]
+        frames = [cv2.imread(os.path.join(frames_dir, key, name)) for name in names]
+        return key, dict(zip(names, detect_face_boxes(frames)))
+
+    print(f"Detecting faces in {len(missing)} videos...")
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for key, faces in executor.map(detect, missing):
+            videos[key].setdefault('faces', {}).update(faces)
+    _write_manifest(manifest_path, videos)
+
+def cache_frame_hashes(frames_dir, video_frames, video_mtimes, manifest_path, num_workers=16):
+    """
+    Returns the content hash (feature_cache.frames_hash) of the given frames of every video.
+
+    Hashes are kept in the manifest under each entry's `hashes`, keyed by the number of frames
+    hashed, and only trusted while the folder mtime matches, so warm starts read no frame files.
+
+    Args:
+        frames_dir (str): Path to the directory containing the video frames.
+        video_frames (dict): Maps '<label>/<video>' to the frame names to hash.
+        video_mtimes (dict): Maps '<label>/<video>' to the folder `mtime_ns` the frame names were listed at.
+        manifest_path (str): Manifest holding the cached hashes.
+        num_workers (int): Threads used to hash the frames.
+
+    Returns:
+        dict: '<label>/<video>' to hex digest.
+    """
+    # Read again from disk, another process (e.g. rank 0) may have hashed the frames since
+    videos = _read_manifest(manifest_path)
+    hashes = {}
+    for key, names in video_frames.items():
+        entry = videos.get(key)
+        if entry is not None and entry['mtime_ns'] == video_mtimes[key]:
+            hashes[key] = entry.get('hashes', {}).get(str(len(names)))
+    missing = [key for key in video_frames if hashes.get(key) is None]
+    if not missing:
+        return hashes
+
+    def hash_video(key):
+        return frames_hash([os.path.join(frames_dir, key, name) for name in video_frames[key]])
+
+    print(f"Hashing the frames of {len(missing)} videos...")
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for key, video_hash in zip(missing, executor.map(hash_video, missing)):
+            hashes[key] = video_hash
+            entry = videos.get(key)
+            if entry is not None and entry['mtime_ns'] == video_mtimes[key]:
+                entry.setdefault('hashes', {})[str(len(video_frames[key]))] = video_hash
+    _write_manifest(manifest_path, videos)
+    return hashes
+
+class _VideoSamples:
+    """Sequence of (frame_paths, label) that only builds the frame paths of a video when it is read."""
+
+    def __init__(self, frames_dir, samples):
+        self.frames_dir = frames_dir
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        video_key, frame_names, label, _ = self.samples[idx]
+        video_dir = os.path.join(self.frames_dir, video_key)
+        return [os.path.join(video_dir, name) for name in frame_names], label
+
+    def face_boxes(self, idx):
+        """Returns the cached face box of every frame of a video, None when faces are not cropped."""
+        return self.samples[idx][3]
 
 class DeepFakeDataset(Dataset):
-    def __init__(self, frames_dir, labels, transform=None, num_frames=10):
+    def __init__(self, frames_dir, labels, transform=None, num_frames=10, manifest_path=None, face_crop=False):
         """
         Args:
             frames_dir (str): Path to the directory containing the video frames.
             labels (dict): Dictionary containing labels for 'real' and 'fake' videos.
             transform (callable, optional): A function/transform to apply to the frames.
             num_frames (int): Number of frames to sample from each video.
+            manifest_path (str, optional): Where to cache the video index, defaults to a file in frames_dir.
+            face_crop (bool): Crop every frame to the tracked face before the transform. Face boxes
+                are detected once and cached in the manifest.
         """
         self.frames_dir = frames_dir
         self.labels = labels
         self.transform = transform
         self.num_frames = num_frames
+        self.manifest_path = manifest_path
+        self.face_crop = face_crop
+        self._content_hashes = None
         self.data = self._load_data()  # Load the data during initialization
 
     def _load_data(self):
         """
-        Loads and processes the frames directly from the `real` or `fake` folders.
+        Indexes one sample per video folder inside the `real` or `fake` folders.
 
         Returns:
-            list: A list of tuples (frame_paths, label).
+            _VideoSamples: A sequence of tuples (frame_paths, label).
         """
-        data = []
-        valid_extensions = ('.jpg', '.jpeg', '.png')  # Image file extensions
+        videos, self.manifest_path = index_videos(self.frames_dir, self.labels, self.manifest_path)
+        self._mtimes = {key: entry['mtime_ns'] for key, entry in videos.items()}
 
-        for label_name, label in self.labels.items():
-            label_dir = os.path.join(self.frames_dir, label_name)
-            print(f"Checking directory: {label_dir}")  # Debugging output
-
-            if not os.path.exists(label_dir):
-                print(f"Directory {label_dir} does not exist.")  # Debugging output
+        samples = []
+        skipped = 0
+        for video_key in sorted(videos):
+            label_name = video_key.split('/', 1)[0]
+            frame_names = videos[video_key]['frames']
+            # Videos with too few frames cannot produce a (num_frames, 3, 224, 224) sample
+            if len(frame_names) < self.num_frames:
+                skipped += 1
                 continue
+            samples.append((video_key, tuple(frame_names[:self.num_frames]), self.labels[label_name]))
 
-            # Load frames directly from the subfolders inside the `real` or `fake` folder
-            frame_paths = []
-            for subfolder in sorted(os.listdir(label_dir)):
-                subfolder_path = os.path.join(label_dir, subfolder)
-                if os.path.isdir(subfolder_path):
-                    # Collect image files from the subfolder that match the naming pattern (e.g., frame_*.jpg)
-                    frames = sorted([os.path.join(subfolder_path, f) for f in os.listdir(subfolder_path) if f.lower().endswith(valid_extensions)])
-                    frame_paths.extend(frames)
-
-            if len(frame_paths) == 0:
-                print(f"No valid frames found in {label_name}")
-                continue
+        if self.face_crop:
+            cache_face_boxes(self.frames_dir, videos, {key: names for key, names, _ in samples}, self.manifest_path)
+            samples = [(key, names, label, tuple(videos[key]['faces'][name] for name in names))
+                       for key, names, label in samples]
+        else:
+            samples = [(key, names, label, None) for key, names, label in samples]
 
-            # Sample frames up to the specified `num_frames`
-            frame_paths = frame_paths[:self.num_frames]
-            data.append((frame_paths, label))
-
-        print(f"Total videos loaded: {len(data)}")  # Debugging output
-        return data
+        print(f"Total videos loaded: {len(samples)} ({skipped} skipped with fewer than {self.num_frames} frames)")
+        return _VideoSamples(self.frames_dir, samples)
 
     def __len__(self):
         """Returns the size of the dataset."""
         return len(self.data)
 
+    def content_hashes(self):
+        """
+        Returns the feature_cache.frames_hash of every sample's frames, in sample order.
+
+        Computed once per dataset and cached in the manifest, keyed by folder mtime.
+        """
+        if self._content_hashes is None:
+            video_frames = {key: names for key, names, _, _ in self.data.samples}
+            hashes = cache_frame_hashes(self.frames_dir, video_frames, self._mtimes, self.manifest_path)
+            self._content_hashes = [hashes[key] for key, _, _, _ in self.data.samples]
+        return self._content_hashes
+
     def __getitem__(self, idx):
         """
         Args:
@@ -74,6 +260,10 @@ class DeepFakeDataset(Dataset):
         frame_paths, label = self.data[idx]
         frames = [Image.open(frame_path).convert('RGB') for frame_path in frame_paths]
 
+        if self.face_crop:
+            frames = [frame.crop((box[0], box[1], box[0] + box[2], box[1] + box[3])) if box is not None else frame
+                      for frame, box in zip(frames, self.data.face_boxes(idx))]
+
         if self.transform:
             frames = [self.transform(frame) for frame in frames]
 
@@ -91,27 +281,28 @@ train_labels = {
     'fake': 1,
 }
 
-# Example of creating the dataset with transforms
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# Initialize the dataset
-dataset = DeepFakeDataset(
-    frames_dir='E:/Project/deepfake detection/data/frames',
-    labels=train_labels,
-    transform=transform,
-    num_frames=10
-)
-
-# Test by printing the length of the dataset
-print(f"Dataset length: {len(dataset)}")
-
-# Get the first item from the dataset
-frames_tensor, label = dataset[0]
-
-# Print the shape of the frames tensor and the label
-print(f"Frames tensor shape: {frames_tensor.shape}")
-print(f"Label: {label}")
+if __name__ == "__main__":
+    # Example of creating the dataset with transforms
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+
+    # Initialize the dataset
+    dataset = DeepFakeDataset(
+        frames_dir='E:/Project/deepfake detection/data/frames',
+        labels=train_labels,
+        transform=transform,
+        num_frames=10
+    )
+
+    # Test by printing the length of the dataset
+    print(f"Dataset length: {len(dataset)}")
+
+    # Get the first item from the dataset
+    frames_tensor, label = dataset[0]
+
+    # Print the shape of the frames tensor and the label
+    print(f"Frames tensor shape: {frames_tensor.shape}")
+    print(f"Label: {label}")
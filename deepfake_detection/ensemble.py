@@ -0,0 +1,152 @@
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import torch
+from torch.utils.data import DataLoader
+
+from model_registry import load_model
+
+def load_calibration(path):
+    """Reads a calibration written by fit_calibration: per-model `weights` on the logits and a `bias`."""
+    with open(path) as f:
+        return json.load(f)
+
+def fit_calibration(logits, labels, steps=100):
+    """
+    Fits a logistic regression on the stacked model logits (Platt scaling over the ensemble).
+
+    Args:
+        logits (Tensor): Shape (num_videos, num_models), one column per model.
+        labels (Tensor): Shape (num_videos,), 0 for real and 1 for fake.
+        steps (int): L-BFGS iterations.
+
+    Returns:
+        dict: `weights` (one per model) and `bias`.
+    """
+    weights = torch.zeros(logits.shape[1], requires_grad=True)
+    bias = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([weights, bias], max_iter=steps)
+    criterion = torch.nn.BCEWithLogitsLoss()
+
+    def closure():
+        optimizer.zero_grad()
+        loss = criterion(logits @ weights + bias, labels.float())
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return {'weights': weights.detach().tolist(), 'bias': bias.item()}
+
+class EnsembleDetector:
+    def __init__(self, models, weights=None, calibration=None):
+        """
+        Runs several detectors on the same preprocessed clip concurrently and combines their logits.
+
+        Every model runs on its own thread (PyTorch releases the GIL inside operators), and on
+        its own CUDA stream when the models are on a GPU, so the ensemble costs about as much
+        wall-clock time as its slowest member.
+
+        Args:
+            models (dict): Model name to detector in eval mode, all on the same device.
+            weights (dict, optional): Model name to weight of its logit, equal weights by default.
+            calibration (dict, optional): Output of fit_calibration, replaces `weights` when given.
+        """
+        self.models = models
+        self.names = list(models)
+        self.device = next(next(iter(models.values())).parameters()).device
+        if calibration is not None:
+            self._weights = torch.tensor(calibration['weights'])
+            self._bias = calibration['bias']
+        else:
+            weights = weights or {name: 1.0 for name in self.names}
+            total = sum(weights[name] for name in self.names)
+            self._weights = torch.tensor([weights[name] / total for name in self.names])
+            self._bias = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix='ensemble')
+        self._streams = {name: torch.cuda.Stream(device=self.device) for name in self.names} \
+            if self.device.type == 'cuda' else {}
+
+    def _run(self, name, frames):
+        started = time.perf_counter()
+        stream = self._streams.get(name)
+        with torch.no_grad(), torch.cuda.stream(stream) if stream is not None else nullcontext():
+            logits = self.models[name](frames).view(-1)
+        if stream is not None:
+            stream.synchronize()
+        return logits.float().cpu(), (time.perf_counter() - started) * 1000
+
+    def predict(self, frames, concurrent=True):
+        """
+        Args:
+            frames (Tensor): A clip of shape (num_frames, 3, 224, 224) or a batch (batch, num_frames, 3, 224, 224).
+            concurrent (bool): Run the models on their threads. When False they run one after the
+                other on the calling thread, e.g. so torch.profiler (which records one thread) sees them.
+
+        Returns:
+            dict: Combined `logits` (one per clip), `compute_ms`, and per model its `logits` and `compute_ms`.
+        """
+        if frames.dim() == 4:
+            frames = frames.unsqueeze(0)
+        started = time.perf_counter()
+        frames = frames.to(self.device, non_blocking=True)
+        if self._streams:
+            # The side streams must not read the clip before its copy on the default stream is done
+            for stream in self._streams.values():
+                stream.wait_stream(torch.cuda.current_stream(self.device))
+
+        per_model = {}
+        if concurrent:
+            futures = {name: self._executor.submit(self._run, name, frames) for name in self.names}
+            for name in self.names:
+                logits, compute_ms = futures[name].result()
+                per_model[name] = {'logits': logits, 'compute_ms': compute_ms}
+        else:
+            for name in self.names:
+                logits, compute_ms = self._run(name, frames)
+                per_model[name] = {'logits': logits, 'compute_ms': compute_ms}
+
+        stacked = torch.stack([per_model[name]['logits'] for name in self.names], dim=1)
+        return {
+            'logits': stacked @ self._weights + self._bias,
+            'compute_ms': (time.perf_counter() - started) * 1000,
+            'per_model': per_model,
+        }
+
+def collect_logits(models, dataset, device, batch_size=8):
+    """Returns (logits of shape (num_videos, num_models), labels) of every model over a dataset."""
+    loader = DataLoader(dataset, batch_size=batch_size)
+    all_logits, all_labels = [], []
+    with torch.no_grad():
+        for frames, labels in loader:
+            frames = frames.to(device)
+            all_logits.append(torch.stack([model(frames).view(-1).float().cpu() for model in models], dim=1))
+            all_labels.append(labels)
+    return torch.cat(all_logits), torch.cat(all_labels)
+
+if __name__ == "__main__":
+    # Only the calibration script needs the training data pipeline, app.py imports this module too
+    from dataset import DeepFakeDataset, train_labels
+    from train import feature_transform
+
+    parser = argparse.ArgumentParser(description="Fit the learned calibration of the ResNet + ResNeXt ensemble")
+    parser.add_argument('frames_dir', help="Labelled real/ and fake/ frames tree, ideally held out from training")
+    parser.add_argument('--resnet-checkpoint', required=True)
+    parser.add_argument('--resnext-checkpoint', required=True)
+    parser.add_argument('--output', default='ensemble_calibration.json')
+    parser.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    models = [load_model('resnet', args.resnet_checkpoint).to(device),
+              load_model('resnext', args.resnext_checkpoint).to(device)]
+    dataset = DeepFakeDataset(args.frames_dir, train_labels, transform=feature_transform, num_frames=10)
+    logits, labels = collect_logits(models, dataset, device, batch_size=args.batch_size)
+
+    calibration = fit_calibration(logits, labels)
+    accuracy = ((logits @ torch.tensor(calibration['weights']) + calibration['bias'] > 0).long() == labels).float().mean()
+    with open(args.output, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    print(f"Calibration {calibration} ({accuracy.item():.2%} accuracy on {len(labels)} videos) written to {args.output}")
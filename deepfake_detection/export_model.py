@@ -0,0 +1,120 @@
+import argparse
+import copy
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from model_registry import ARCHITECTURES, load_model
+
+def build_model(arch, checkpoint=None):
+    return load_model(arch, checkpoint)
+
+def fold_batchnorm(backbone):
+    """Folds every BatchNorm of a ResNet/ResNeXt (in eval mode) into the preceding convolution."""
+    backbone.conv1 = fuse_conv_bn_eval(backbone.conv1, backbone.bn1)
+    backbone.bn1 = nn.Identity()
+
+    for layer in (backbone.layer1, backbone.layer2, backbone.layer3, backbone.layer4):
+        for block in layer:
+            for conv_name, bn_name in (('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3')):
+                setattr(block, conv_name, fuse_conv_bn_eval(getattr(block, conv_name), getattr(block, bn_name)))
+                setattr(block, bn_name, nn.Identity())
+            if block.downsample is not None:
+                block.downsample = nn.Sequential(fuse_conv_bn_eval(block.downsample[0], block.downsample[1]))
+    return backbone
+
+def prepare_for_export(model, arch):
+    """Returns an eval-mode copy of the model with BatchNorm folded into its backbone."""
+    _, backbone_attr = ARCHITECTURES[arch]
+    exported = copy.deepcopy(model).eval()
+    fold_batchnorm(getattr(exported, backbone_attr))
+    return exported
+
+def export_torchscript(model, output_path, num_frames=10):
+    example = torch.randn(1, num_frames, 3, 224, 224)
+    with torch.no_grad():
+        # Sizes are read with x.size() in forward, so the trace keeps batch and frame count dynamic
+        traced = torch.jit.trace(model, example)
+        traced = torch.jit.freeze(traced)
+    traced.save(output_path)
+
+def export_onnx(model, output_path, num_frames=10, opset_version=17):
+    example = torch.randn(1, num_frames, 3, 224, 224)
+    torch.onnx.export(
+        model,
+        example,
+        output_path,
+        input_names=['frames'],
+        output_names=['logits'],
+        dynamic_axes={'frames': {0: 'batch', 1: 'num_frames'}, 'logits': {0: 'batch'}},
+        opset_version=opset_version,
+        do_constant_folding=True
+    )
+
+class OnnxModel:
+    """Callable wrapper that runs an exported ONNX detector with ONNX Runtime on tensors."""
+
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("Serving an ONNX artifact requires the onnxruntime package")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, frames):
+        outputs = self.session.run(None, {'frames': frames.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+def load_exported_model(path):
+    """Loads a TorchScript (.pt) or ONNX (.onnx) artifact written by this script."""
+    if path.endswith('.onnx'):
+        return OnnxModel(path)
+    model = torch.jit.load(path, map_location='cpu')
+    return model.eval()
+
+def check_parity(eager_model, exported_model, shapes=((1, 10), (2, 6), (3, 16)), atol=1e-3):
+    """
+    Compares eager and exported outputs on random clips of several (batch, num_frames) shapes.
+
+    Returns:
+        float: The largest absolute difference seen. Raises AssertionError above `atol`.
+    """
+    eager_model.eval()
+    max_diff = 0.0
+    with torch.no_grad():
+        for batch, num_frames in shapes:
+            frames = torch.randn(batch, num_frames, 3, 224, 224)
+            expected = eager_model(frames)
+            actual = exported_model(frames)
+            diff = (expected - actual).abs().max().item()
+            print(f"batch={batch} num_frames={num_frames}: max abs diff {diff:.2e}")
+            max_diff = max(max_diff, diff)
+
+    assert max_diff <= atol, f"Exported model differs from eager by {max_diff:.2e} (tolerance {atol:.0e})"
+    return max_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a deepfake detector to TorchScript or ONNX")
+    parser.add_argument('--arch', choices=sorted(ARCHITECTURES), default='resnet')
+    parser.add_argument('--checkpoint', help="State dict to export (default: ImageNet backbone, untrained head)")
+    parser.add_argument('--format', choices=['torchscript', 'onnx'], default='torchscript')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--atol', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    eager = build_model(args.arch, args.checkpoint)
+    model = prepare_for_export(eager, args.arch)
+    if args.format == 'onnx':
+        export_onnx(model, args.output)
+    else:
+        export_torchscript(model, args.output)
+    print(f"Exported {args.arch} model to {args.output}")
+
+    check_parity(eager, load_exported_model(args.output), atol=args.atol)
+    print("Parity check passed")
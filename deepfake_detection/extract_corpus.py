@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from data_preprocessing import read_frames_sequential
+from dataset import SCRATCH_SUFFIX
+from frame_sampling import DETAIL_FRAME_HEIGHT, sample_frames
+from journal import finished, read_jsonl
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+MANIFEST_NAME = 'manifest.jsonl'
+
+def find_videos(videos_dir, labels):
+    """Returns (relative_path, label_name) for every video under videos_dir/<label_name>/."""
+    videos = []
+    for label_name in labels:
+        label_dir = os.path.join(videos_dir, label_name)
+        if not os.path.isdir(label_dir):
+            print(f"Directory {label_dir} does not exist, skipping.")
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                videos.append((os.path.join(label_name, name), label_name))
+    return videos
+
+def extract_video(videos_dir, frames_dir, video, label_name, num_frames, adaptive=False):
+    """Extracts one video into frames_dir/<label_name>/<video file name>/frame_*.jpg, names zero-padded to sort in order."""
+    # The extension stays in the folder name so a.mp4 and a.avi don't overwrite each other
+    output_dir = os.path.join(frames_dir, label_name, os.path.basename(video))
+    partial_dir = output_dir + SCRATCH_SUFFIX
+
+    try:
+        sampling = {}
+        if adaptive:
+            frames, stats = sample_frames(os.path.join(videos_dir, video), num_frames=num_frames,
+                                          frame_height=DETAIL_FRAME_HEIGHT)
+            sampling = {'mode': stats['mode'], 'decode_seconds': stats['decode_seconds'],
+                        'diversity': stats['diversity'], 'duplicates_dropped': stats['duplicates_dropped']}
+        else:
+            frames = read_frames_sequential(os.path.join(videos_dir, video), num_frames=num_frames)
+
+        # Frames go to a scratch directory first so an interrupted video never looks complete
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(partial_dir, f'frame_{i:05d}.jpg'), frame)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(partial_dir, output_dir)
+        return {'video': video, 'label': label_name, 'status': 'ok', 'frames': len(frames), **sampling}
+    except Exception as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return {'video': video, 'label': label_name, 'status': 'error', 'frames': 0, 'error': str(e)}
+
+def extract_corpus(videos_dir, frames_dir, labels=('real', 'fake'), num_frames=10, num_workers=None,
+                   report_every=50, adaptive=False):
+    """
+    Extracts every video under videos_dir/<label>/ on a process pool.
+
+    Finished videos are appended to frames_dir/manifest.jsonl, and a rerun skips them.
+    With `adaptive`, frames are picked by frame_sampling.sample_frames and the decode time
+    and diversity of every video are recorded in the manifest.
+
+    Returns:
+        dict: Number of videos and frames extracted, failures and throughput.
+    """
+    os.makedirs(frames_dir, exist_ok=True)
+    manifest_path = os.path.join(frames_dir, MANIFEST_NAME)
+    done = finished(read_jsonl(manifest_path))
+
+    videos = [(video, label_name) for video, label_name in find_videos(videos_dir, labels) if video not in done]
+    print(f"{len(done)} videos already extracted, {len(videos)} to go")
+
+    extracted, failed, frames_written = 0, 0, 0
+    decode_seconds, diversity = 0.0, 0.0
+    start = time.perf_counter()
+    with open(manifest_path, 'a') as manifest, ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(extract_video, videos_dir, frames_dir, video, label_name, num_frames, adaptive)
+            for video, label_name in videos
+        ]
+        for future in as_completed(futures):
+            entry = future.result()
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+
+            if entry['status'] == 'ok':
+                extracted += 1
+                frames_written += entry['frames']
+                decode_seconds += entry.get('decode_seconds', 0.0)
+                diversity += entry.get('diversity', 0.0)
+            else:
+                failed += 1
+                print(f"Failed to extract {entry['video']}: {entry['error']}")
+
+            if (extracted + failed) % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{extracted + failed}/{len(videos)} videos, "
+                      f"{extracted / elapsed:.2f} videos/sec, {frames_written / elapsed:.1f} frames/sec")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'videos': extracted,
+        'failed': failed,
+        'frames': frames_written,
+        'seconds': elapsed,
+        'videos_per_sec': extracted / elapsed if elapsed > 0 else 0.0,
+        'frames_per_sec': frames_written / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"Extracted {extracted} videos ({failed} failed) in {elapsed:.1f}s: "
+          f"{summary['videos_per_sec']:.2f} videos/sec, {summary['frames_per_sec']:.1f} frames/sec")
+    if adaptive and extracted:
+        summary['mean_decode_seconds'] = decode_seconds / extracted
+        summary['mean_diversity'] = diversity / extracted
+        print(f"Adaptive sampling: {summary['mean_decode_seconds'] * 1000:.1f} ms decode per video, "
+              f"mean diversity {summary['mean_diversity']:.3f}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract frames from real/ and fake/ videos into the training layout")
+    parser.add_argument('videos_dir', help="Directory containing real/ and fake/ video folders")
+    parser.add_argument('frames_dir', help="Output directory, laid out as <label>/<video>/frame_*.jpg")
+    parser.add_argument('--num-frames', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--adaptive', action='store_true', help="Keep the most informative frames instead of fixed intervals")
+    args = parser.parse_args()
+
+    extract_corpus(args.videos_dir, args.frames_dir, num_frames=args.num_frames, num_workers=args.workers,
+                   adaptive=args.adaptive)
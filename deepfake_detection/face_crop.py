@@ -0,0 +1,158 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# Haar cascade bundled with opencv-python, no model download needed
+DEFAULT_CASCADE = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+
+_local = threading.local()
+
+def _get_cascade(cascade_path):
+    # CascadeClassifier is not thread-safe, so every thread loads its own (once)
+    cascades = getattr(_local, 'cascades', None)
+    if cascades is None:
+        cascades = _local.cascades = {}
+    cascade = cascades.get(cascade_path)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cascade_path)
+        if cascade.empty():
+            raise ValueError(f"Failed to load face cascade {cascade_path}")
+        cascades[cascade_path] = cascade
+    return cascade
+
+def pad_box(box, frame_shape, padding=0.3):
+    """
+    Grows a face box into a square with `padding` of the face size on every side, clipped to the frame.
+
+    Returns:
+        list: [x, y, width, height] in frame pixels.
+    """
+    x, y, w, h = box
+    frame_h, frame_w = frame_shape[:2]
+    side = min(int(round(max(w, h) * (1 + 2 * padding))), frame_w, frame_h)
+    center_x, center_y = x + w / 2, y + h / 2
+    left = int(round(min(max(center_x - side / 2, 0), frame_w - side)))
+    top = int(round(min(max(center_y - side / 2, 0), frame_h - side)))
+    return [left, top, side, side]
+
+class FaceTracker:
+    def __init__(self, padding=0.3, detect_width=320, min_face_size=24, search_margin=0.5, max_missed=2,
+                 cascade_path=DEFAULT_CASCADE):
+        """
+        Follows one face across the frames of a video with a Haar cascade.
+
+        The first face is found by a full-frame detection on a downscaled copy of the frame.
+        After that the detector only searches a window around the last box, and when the face
+        is not found there the last box is reused, for up to `max_missed` frames before falling
+        back to a full-frame detection.
+
+        Args:
+            padding (float): Context kept around the face, as a fraction of the face size per side.
+            detect_width (int): Frames are downscaled to this width before detection.
+            min_face_size (int): Smallest face detected, in pixels of the downscaled frame.
+            search_margin (float): Size of the tracking window around the last box, as a fraction of the box.
+            max_missed (int): Frames the last box is reused for when tracking loses the face.
+            cascade_path (str): OpenCV cascade XML file.
+        """
+        self.padding = padding
+        self.detect_width = detect_width
+        self.min_face_size = min_face_size
+        self.search_margin = search_margin
+        self.max_missed = max_missed
+        self.cascade = _get_cascade(cascade_path)
+        self.reset()
+
+    def reset(self):
+        self._box = None  # Last face box in downscaled coordinates
+        self._missed = 0
+
+    def _detect(self, gray, region=None):
+        offset_x, offset_y = 0, 0
+        if region is not None:
+            offset_x, offset_y, w, h = region
+            gray = gray[offset_y:offset_y + h, offset_x:offset_x + w]
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(self.min_face_size, self.min_face_size))
+        if len(faces) == 0:
+            return None
+
+        faces = [(x + offset_x, y + offset_y, w, h) for x, y, w, h in faces]
+        if self._box is None:
+            # The largest face is taken as the subject of the video
+            return max(faces, key=lambda face: face[2] * face[3])
+        # Stay on the same face: the detection closest to the last box
+        last_x, last_y = self._box[0] + self._box[2] / 2, self._box[1] + self._box[3] / 2
+        return min(faces, key=lambda face: (face[0] + face[2] / 2 - last_x) ** 2 + (face[1] + face[3] / 2 - last_y) ** 2)
+
+    def _search_region(self, shape):
+        x, y, w, h = self._box
+        margin_x, margin_y = int(w * self.search_margin), int(h * self.search_margin)
+        left, top = max(x - margin_x, 0), max(y - margin_y, 0)
+        right, bottom = min(x + w + margin_x, shape[1]), min(y + h + margin_y, shape[0])
+        return left, top, right - left, bottom - top
+
+    def update(self, frame):
+        """
+        Finds the face in the next BGR frame of the video.
+
+        Returns:
+            list: Padded [x, y, width, height] crop box in frame pixels, or None while no face was seen.
+        """
+        scale = min(self.detect_width / frame.shape[1], 1.0)
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+        gray = cv2.equalizeHist(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+
+        face = None
+        if self._box is not None:
+            face = self._detect(gray, self._search_region(gray.shape))
+            if face is None and self._missed >= self.max_missed:
+                face = self._detect(gray)
+        else:
+            face = self._detect(gray)
+
+        if face is not None:
+            self._box = face
+            self._missed = 0
+        elif self._box is not None:
+            self._missed += 1
+        else:
+            return None
+
+        box = [int(round(v / scale)) for v in self._box]
+        return pad_box(box, frame.shape, self.padding)
+
+def detect_face_boxes(frames, **tracker_kwargs):
+    """
+    Tracks the face through a video's sampled frames, in order.
+
+    Frames before the first detection reuse the first box found. When no face is found
+    anywhere, every box is None and the frames are used whole.
+
+    Args:
+        frames (iterable): BGR frames (np.ndarray of shape (height, width, 3)).
+        **tracker_kwargs: Passed to FaceTracker.
+
+    Returns:
+        list: One [x, y, width, height] box (or None) per frame.
+    """
+    tracker = FaceTracker(**tracker_kwargs)
+    boxes = [tracker.update(frame) for frame in frames]
+    first = next((box for box in boxes if box is not None), None)
+    return [box if box is not None else first for box in boxes]
+
+def crop_frames(frames, boxes, size=(224, 224)):
+    """
+    Crops every frame to its box (the whole frame when the box is None) and resizes it.
+
+    Returns:
+        np.ndarray: A uint8 array of shape (num_frames, height, width, 3).
+    """
+    output = np.empty((len(frames), size[0], size[1], 3), dtype=np.uint8)
+    for i, (frame, box) in enumerate(zip(frames, boxes)):
+        if box is not None:
+            x, y, w, h = box
+            frame = frame[y:y + h, x:x + w]
+        output[i] = cv2.resize(frame, (size[1], size[0]), interpolation=cv2.INTER_AREA)
+    return output
@@ -0,0 +1,247 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: only one process may write to a cache directory at a time
+
+def content_hash(filepath, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def frames_hash(frame_paths, chunk_size=1 << 20):
+    """Returns one SHA-256 hex digest over the contents of a video's frame files, in order."""
+    digest = hashlib.sha256()
+    for frame_path in frame_paths:
+        with open(frame_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+class FeatureCache:
+    def __init__(self, cache_dir, backbone_name, feature_size=2048, growth=4096):
+        """
+        Memory-mapped on-disk store of backbone features keyed by (video hash, frame index).
+
+        Args:
+            cache_dir (str): Root directory of the cache, one subdirectory is used per backbone.
+            backbone_name (str): Name of the backbone that produced the features (e.g. 'resnet50').
+            feature_size (int): Length of one frame's feature vector.
+            growth (int): Number of rows the feature file grows by when it is full.
+        """
+        self.cache_dir = os.path.join(cache_dir, backbone_name)
+        self.backbone_name = backbone_name
+        self.feature_size = feature_size
+        self.growth = growth
+        self._data_path = os.path.join(self.cache_dir, 'features.f32')
+        self._index_path = os.path.join(self.cache_dir, 'index.txt')
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._next_row = 0
+        self._index_offset = 0  # Bytes of the index already read into _rows
+        self._capacity = 0
+        self._features = None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'rb') as f:
+                self._read_index(f)
+
+        if os.path.exists(self._data_path):
+            self._capacity = os.path.getsize(self._data_path) // (4 * self.feature_size)
+            if self._capacity > 0:
+                self._features = np.memmap(self._data_path, dtype=np.float32, mode='r+',
+                                           shape=(self._capacity, self.feature_size))
+
+    def _read_index(self, f):
+        # The index is an append-only log of "video_hash frame_index row" lines, shared by every
+        # process using the cache, so only the lines appended since the last read are parsed
+        f.seek(self._index_offset)
+        data = f.read()
+        # A partial last line is left unread, put() discards it once it holds the lock
+        complete = data.rfind(b'\n') + 1
+        self._index_offset += complete
+        for line in data[:complete].decode().splitlines():
+            parts = line.split()
+            if len(parts) == 3:
+                row = int(parts[2])
+                self._rows[(parts[0], int(parts[1]))] = row
+                self._next_row = max(self._next_row, row + 1)
+
+    def _ensure_capacity(self, rows_needed):
+        if rows_needed <= self._capacity:
+            return
+        # Another process may already have grown the file, it is never shrunk
+        on_disk = os.path.getsize(self._data_path) // (4 * self.feature_size) if os.path.exists(self._data_path) else 0
+        new_capacity = max(rows_needed, on_disk)
+        if new_capacity > on_disk:
+            new_capacity = max(new_capacity, on_disk + self.growth)
+        if self._features is not None:
+            self._features.flush()
+            del self._features
+        if new_capacity > on_disk:
+            with open(self._data_path, 'ab') as f:
+                f.truncate(new_capacity * 4 * self.feature_size)
+        self._capacity = new_capacity
+        self._features = np.memmap(self._data_path, dtype=np.float32, mode='r+',
+                                   shape=(self._capacity, self.feature_size))
+
+    def __getstate__(self):
+        # DataLoader workers reopen the memmap instead of pickling the feature file
+        state = self.__dict__.copy()
+        state['_features'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self._capacity > 0:
+            self._features = np.memmap(self._data_path, dtype=np.float32, mode='r+',
+                                       shape=(self._capacity, self.feature_size))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def frame_count(self, video_hash):
+        """Returns the number of leading frames (0..n-1) of a video that are cached."""
+        count = 0
+        while (video_hash, count) in self._rows:
+            count += 1
+        return count
+
+    def contains(self, video_hash, num_frames):
+        return all((video_hash, i) in self._rows for i in range(num_frames))
+
+    def get(self, video_hash, num_frames):
+        """
+        Returns the cached features of frames 0..num_frames-1 as a (num_frames, feature_size)
+        tensor, or None if any of them is missing.
+        """
+        with self._lock:
+            rows = [self._rows.get((video_hash, i)) for i in range(num_frames)]
+            if any(row is None for row in rows):
+                return None
+            return torch.from_numpy(np.array(self._features[rows]))
+
+    def put(self, video_hash, features):
+        """
+        Stores the features of one video, a (num_frames, feature_size) tensor or array,
+        under frame indices 0..num_frames-1.
+        """
+        if isinstance(features, torch.Tensor):
+            features = features.detach().float().cpu().numpy()
+
+        with self._lock:
+            if all((video_hash, i) in self._rows for i in range(len(features))):
+                return
+
+            # Gunicorn workers, app.py and train.py can share a cache directory: rows are allocated,
+            # written and indexed under an exclusive lock on the index, after reading the rows
+            # the other processes have added
+            with open(self._index_path, 'a+b') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._read_index(f)
+                    new_keys = [(video_hash, i) for i in range(len(features)) if (video_hash, i) not in self._rows]
+                    first_row = self._next_row
+                    # Also maps the rows the other processes have written, for get()
+                    self._ensure_capacity(first_row + len(new_keys))
+                    if not new_keys:
+                        return
+
+                    lines = []
+                    for offset, key in enumerate(new_keys):
+                        row = first_row + offset
+                        self._features[row] = features[key[1]]
+                        lines.append(f"{key[0]} {key[1]} {row}\n")
+                    self._features.flush()
+
+                    f.seek(0, os.SEEK_END)
+                    if f.tell() > self._index_offset:
+                        # Partial line of a writer killed mid-append, it is discarded
+                        f.write(b'\n')
+                        self._index_offset = f.tell()
+
+                    # Features are flushed before the index so a crash never indexes unwritten rows
+                    data = ''.join(lines).encode()
+                    f.write(data)
+                    f.flush()
+                    self._index_offset += len(data)
+                    for offset, key in enumerate(new_keys):
+                        self._rows[key] = first_row + offset
+                    self._next_row = first_row + len(new_keys)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+def precompute_features(model, dataset, cache, device, batch_size=8):
+    """
+    Runs the backbone once over every sample of a DeepFakeDataset that is not cached yet.
+
+    The dataset should use a deterministic transform, cached features replace the
+    per-epoch augmentations of the frames.
+    """
+    model.eval()
+    pending_hashes, pending_frames = [], []
+    computed = 0
+
+    def flush():
+        frames = torch.stack(pending_frames).to(device)
+        with torch.no_grad():
+            features = model.extract_features(frames)
+        for video_hash, video_features in zip(pending_hashes, features):
+            cache.put(video_hash, video_features)
+        pending_hashes.clear()
+        pending_frames.clear()
+
+    for idx, video_hash in enumerate(dataset.content_hashes()):
+        if cache.contains(video_hash, dataset.num_frames):
+            continue
+        frames, _ = dataset[idx]
+        pending_hashes.append(video_hash)
+        pending_frames.append(frames)
+        computed += 1
+        if len(pending_frames) == batch_size:
+            flush()
+
+    if pending_frames:
+        flush()
+
+    print(f"Cached backbone features for {computed} videos ({len(dataset.data) - computed} already cached)")
+
+class CachedFeatureDataset(Dataset):
+    def __init__(self, dataset, cache):
+        """
+        Args:
+            dataset (DeepFakeDataset): Dataset whose samples were cached with precompute_features.
+            cache (FeatureCache): Cache holding the backbone features.
+        """
+        self.cache = cache
+        self.num_frames = dataset.num_frames
+        # Hashed once by the dataset and cached in its manifest, not re-read from the frame files
+        self.samples = [(video_hash, label) for video_hash, (_, label) in zip(dataset.content_hashes(), dataset.data)]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        video_hash, label = self.samples[idx]
+        features = self.cache.get(video_hash, self.num_frames)
+        if features is None:
+            raise KeyError(f"Features for video {video_hash} are not cached")
+        return features, torch.tensor(label)
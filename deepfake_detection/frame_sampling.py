@@ -0,0 +1,182 @@
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import av  # PyAV, optional: decodes keyframes only for very long videos
+except ImportError:
+    av = None
+
+THUMBNAIL_SIZE = (64, 36)  # (width, height) of the grayscale thumbnail frames are compared on
+HISTOGRAM_BINS = [8, 8, 8]
+# Candidates are held downscaled, 4 * num_frames full 1080p frames would take about 250 MB.
+# The model input is 224 pixels high, frames that are saved or face-cropped keep more detail
+MODEL_FRAME_HEIGHT = 224
+DETAIL_FRAME_HEIGHT = 480
+
+def downscale(frame, height):
+    """Resizes a frame to `height` pixels high, keeping its aspect ratio. Never upscales, None keeps the frame."""
+    if height is None or frame.shape[0] <= height:
+        return frame
+    width = max(int(round(frame.shape[1] * height / frame.shape[0])), 1)
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+def frame_signature(frame):
+    """Returns a cheap (grayscale thumbnail, normalized color histogram) signature of a BGR frame."""
+    small = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+    hist = cv2.calcHist([small], [0, 1, 2], None, HISTOGRAM_BINS, [0, 256, 0, 256, 0, 256])
+    return gray, cv2.normalize(hist, hist).flatten()
+
+def signature_distance(a, b):
+    """Distance in [0, 1] between two signatures: pixel difference and color histogram distance, averaged."""
+    pixel = float(np.abs(a[0] - b[0]).mean())
+    color = cv2.compareHist(a[1], b[1], cv2.HISTCMP_BHATTACHARYYA)
+    return 0.5 * pixel + 0.5 * min(max(color, 0.0), 1.0)
+
+class _Selection:
+    """Candidates kept in temporal order, thinned by dropping the one closest to its predecessor."""
+
+    def __init__(self, num_frames, max_candidates, duplicate_threshold, frame_height=None):
+        self.num_frames = num_frames
+        self.max_candidates = max_candidates
+        self.duplicate_threshold = duplicate_threshold
+        self.frame_height = frame_height
+        self.candidates = []  # [position, signature, frame, distance to the previous candidate]
+        self.duplicates = 0
+
+    def offer(self, position, frame):
+        frame = downscale(frame, self.frame_height)
+        signature = frame_signature(frame)
+        distance = signature_distance(self.candidates[-1][1], signature) if self.candidates else float('inf')
+        # Near-duplicates are only kept while there are not enough frames yet
+        if distance < self.duplicate_threshold and len(self.candidates) >= self.num_frames:
+            self.duplicates += 1
+            return
+        self.candidates.append([position, signature, frame, distance])
+        if len(self.candidates) > self.max_candidates:
+            self._drop_least_informative()
+
+    def _drop_least_informative(self):
+        # The first candidate is always kept, its distance is infinite
+        i = min(range(len(self.candidates)), key=lambda idx: self.candidates[idx][3])
+        del self.candidates[i]
+        if i < len(self.candidates):
+            self.candidates[i][3] = (signature_distance(self.candidates[i - 1][1], self.candidates[i][1])
+                                     if i > 0 else float('inf'))
+
+    def select(self):
+        while len(self.candidates) > self.num_frames:
+            self._drop_least_informative()
+        return self.candidates
+
+def sample_diversity(frames):
+    """Mean signature distance between consecutive frames, higher means the frames carry more distinct content."""
+    signatures = [frame_signature(frame) for frame in frames]
+    if len(signatures) < 2:
+        return 0.0
+    return float(np.mean([signature_distance(a, b) for a, b in zip(signatures, signatures[1:])]))
+
+def _scan_sequential(cap, selection, candidate_stride):
+    decoded = 0
+    position = 0
+    while cap.grab():
+        decoded += 1
+        # Every frame is decoded, but only candidates are converted and scored
+        if position % candidate_stride == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                selection.offer(position, frame)
+        position += 1
+    return decoded
+
+def _scan_keyframes(filepath, selection):
+    decoded = 0
+    with av.open(filepath) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = 'NONKEY'
+        for frame in container.decode(stream):
+            decoded += 1
+            selection.offer(frame.pts if frame.pts is not None else decoded, frame.to_ndarray(format='bgr24'))
+    return decoded
+
+def _scan_seeking(cap, selection, total_frames, num_candidates):
+    # Without PyAV a long video falls back to seeking to evenly spaced candidates
+    decoded = 0
+    for position in np.linspace(0, total_frames - 1, num_candidates).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+        ret, frame = cap.read()
+        if ret:
+            decoded += 1
+            selection.offer(int(position), frame)
+    return decoded
+
+def sample_frames(filepath, num_frames=10, candidate_fps=4.0, duplicate_threshold=0.02, max_candidates=None,
+                  long_video_seconds=600, frame_height=MODEL_FRAME_HEIGHT):
+    """
+    Picks the `num_frames` most informative frames of a video.
+
+    The video is decoded in one sequential pass, which does not rely on CAP_PROP_FRAME_COUNT
+    and never seeks. Candidates are taken at `candidate_fps` and scored on a downscaled
+    thumbnail and color histogram. A candidate too similar to the previous one is dropped as
+    a near-duplicate, and the candidate closest to its predecessor is dropped until
+    `num_frames` remain, so scene changes are kept and static stretches are thinned out.
+    Videos longer than `long_video_seconds` are scanned on keyframes only (PyAV) or on
+    seeked candidates, so their cost grows with the number of candidates, not their length.
+
+    Args:
+        filepath (str): Path to the video file.
+        num_frames (int): Number of frames to return.
+        candidate_fps (float): Candidates scored per second of video.
+        duplicate_threshold (float): Signature distance under which a candidate is a near-duplicate.
+        max_candidates (int, optional): Candidates held in memory at once, defaults to 4 * num_frames.
+        long_video_seconds (float): Duration above which only keyframes are decoded.
+        frame_height (int, optional): Candidates are held and returned downscaled to this height,
+            None keeps the full resolution.
+
+    Returns:
+        tuple: (frames, stats) where frames is a uint8 array of shape (frames_selected, height, width, 3)
+            in BGR and temporal order, and stats reports the `mode`, `decode_seconds`, `frames_decoded`,
+            `duplicates_dropped` and the `diversity` of the selected frames.
+    """
+    started = time.perf_counter()
+    selection = _Selection(num_frames, max_candidates or 4 * num_frames, duplicate_threshold, frame_height)
+
+    cap = cv2.VideoCapture(filepath)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video file")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # The frame count is only trusted for this decision, a wrong count just picks the sequential pass
+        duration = total_frames / fps if fps > 0 and total_frames > 0 else 0.0
+        if duration > long_video_seconds and av is not None:
+            cap.release()
+            mode = 'keyframes'
+            decoded = _scan_keyframes(filepath, selection)
+        elif duration > long_video_seconds:
+            mode = 'seek'
+            decoded = _scan_seeking(cap, selection, total_frames, selection.max_candidates)
+        else:
+            mode = 'sequential'
+            candidate_stride = max(int(round(fps / candidate_fps)), 1) if fps > 0 else 1
+            decoded = _scan_sequential(cap, selection, candidate_stride)
+    finally:
+        cap.release()
+
+    selected = selection.select()
+    if not selected:
+        raise ValueError("No frames were extracted from the video")
+
+    frames = np.stack([candidate[2] for candidate in selected])
+    distances = [candidate[3] for candidate in selected[1:]]
+    stats = {
+        'mode': mode,
+        'decode_seconds': time.perf_counter() - started,
+        'frames_decoded': decoded,
+        'positions': [int(candidate[0]) for candidate in selected],
+        'duplicates_dropped': selection.duplicates,
+        'diversity': float(np.mean(distances)) if distances else 0.0,
+    }
+    return frames, stats
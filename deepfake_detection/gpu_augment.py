@@ -0,0 +1,99 @@
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Luma weights used by torchvision's grayscale conversion
+_GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+_RGB_TO_YIQ = torch.tensor([
+    [0.299, 0.587, 0.114],
+    [0.596, -0.274, -0.322],
+    [0.211, -0.523, 0.312],
+])
+
+class ClipAugment(nn.Module):
+    def __init__(self, flip_p=0.5, degrees=10, brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1):
+        """
+        Batched, on-device version of train.py's RandomHorizontalFlip, RandomRotation and ColorJitter.
+
+        Random parameters are drawn once per clip and applied to all of its frames, so the
+        augmentation is temporally consistent. Inputs are (batch, num_frames, 3, H, W) in [0, 1].
+        """
+        super(ClipAugment, self).__init__()
+        self.flip_p = flip_p
+        self.degrees = degrees
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+
+    @staticmethod
+    def _uniform(batch_size, low, high, device):
+        return torch.empty(batch_size, device=device).uniform_(low, high)
+
+    @staticmethod
+    def _grayscale(x):
+        r, g, b = x.unbind(dim=-3)
+        return (_GRAY_WEIGHTS[0] * r + _GRAY_WEIGHTS[1] * g + _GRAY_WEIGHTS[2] * b).unsqueeze(-3)
+
+    def _rotate(self, x, angles):
+        batch_size, num_frames, c, h, w = x.shape
+        radians = angles * math.pi / 180
+        cos, sin = torch.cos(radians), torch.sin(radians)
+        zeros = torch.zeros_like(cos)
+        theta = torch.stack([
+            torch.stack([cos, -sin, zeros], dim=-1),
+            torch.stack([sin, cos, zeros], dim=-1),
+        ], dim=1)
+        # Same rotation for every frame of a clip
+        theta = theta.repeat_interleave(num_frames, dim=0)
+
+        frames = x.reshape(batch_size * num_frames, c, h, w)
+        grid = F.affine_grid(theta, frames.shape, align_corners=False)
+        rotated = F.grid_sample(frames, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+        return rotated.reshape(batch_size, num_frames, c, h, w)
+
+    def _shift_hue(self, x, shifts):
+        # Rotating the chroma plane in YIQ space approximates a hue shift without an HSV round trip
+        rgb_to_yiq = _RGB_TO_YIQ.to(x.device, x.dtype)
+        yiq = torch.einsum('ij,btjhw->btihw', rgb_to_yiq, x)
+        angle = shifts * 2 * math.pi
+        cos, sin = torch.cos(angle).view(-1, 1, 1, 1), torch.sin(angle).view(-1, 1, 1, 1)
+        i, q = yiq[:, :, 1], yiq[:, :, 2]
+        yiq = torch.stack([yiq[:, :, 0], i * cos - q * sin, i * sin + q * cos], dim=2)
+        return torch.einsum('ij,btjhw->btihw', torch.linalg.inv(rgb_to_yiq), yiq)
+
+    def forward(self, x):
+        if not self.training:
+            return x
+
+        batch_size = x.shape[0]
+        device = x.device
+        per_clip = (batch_size, 1, 1, 1, 1)
+
+        flip = torch.rand(batch_size, device=device) < self.flip_p
+        x = torch.where(flip.view(per_clip), x.flip(-1), x)
+
+        if self.degrees:
+            x = self._rotate(x, self._uniform(batch_size, -self.degrees, self.degrees, device))
+
+        if self.brightness:
+            factors = self._uniform(batch_size, 1 - self.brightness, 1 + self.brightness, device)
+            x = (x * factors.view(per_clip)).clamp(0, 1)
+
+        if self.contrast:
+            factors = self._uniform(batch_size, 1 - self.contrast, 1 + self.contrast, device).view(per_clip)
+            mean = self._grayscale(x).mean(dim=(-3, -2, -1), keepdim=True)
+            x = (mean + (x - mean) * factors).clamp(0, 1)
+
+        if self.saturation:
+            factors = self._uniform(batch_size, 1 - self.saturation, 1 + self.saturation, device).view(per_clip)
+            gray = self._grayscale(x)
+            x = (gray + (x - gray) * factors).clamp(0, 1)
+
+        if self.hue:
+            x = self._shift_hue(x, self._uniform(batch_size, -self.hue, self.hue, device)).clamp(0, 1)
+
+        return x
@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+class _PendingRequest:
+    __slots__ = ('frames', 'future', 'enqueued_at')
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+class BatchingInferenceWorker:
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10, max_queue_size=64, device=None, history_size=1000):
+        """
+        Args:
+            model (callable): Module (or function) called once per batch of shape (batch, num_frames, 3, 224, 224).
+            max_batch_size (int): Largest number of clips combined into one forward pass.
+            max_wait_ms (float): Longest time the oldest queued clip waits for a batch to fill up.
+            max_queue_size (int): Number of clips that may wait in the queue before submit() rejects new ones.
+            device (torch.device, optional): Device batches are moved to. Defaults to the model's device.
+            history_size (int): Number of recent requests kept for the timing statistics.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.device = device if device is not None else self._model_device(model)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._queue_ms = deque(maxlen=history_size)
+        self._compute_ms = deque(maxlen=history_size)
+        self._batch_sizes = deque(maxlen=history_size)
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name='inference-worker', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _model_device(model):
+        try:
+            return next(model.parameters()).device
+        except (AttributeError, StopIteration):
+            return torch.device('cpu')
+
+    def submit(self, frames):
+        """
+        Queues a single clip of shape (num_frames, 3, 224, 224) and returns a Future.
+
+        The Future resolves to a dict with the model `output` for this clip and the
+        `queue_ms`, `compute_ms` and `batch_size` of the forward pass that served it.
+        """
+        request = _PendingRequest(frames)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            raise RuntimeError("Inference queue is full, try again later")
+        return request.future
+
+    def predict(self, frames, timeout=None):
+        return self.submit(frames).result(timeout=timeout)
+
+    def predict_inline(self, frames):
+        """
+        Runs one clip on the calling thread, outside the batches, and returns the same dict as
+        a submitted clip. Used for profiled requests, the profiler only records its own thread.
+        """
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model(frames.unsqueeze(0).to(self.device))
+        if isinstance(outputs, torch.Tensor):
+            outputs = outputs.cpu()
+        return {
+            'output': outputs[0],
+            'queue_ms': 0.0,
+            'compute_ms': (time.perf_counter() - started) * 1000,
+            'batch_size': 1,
+        }
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish the current batch first, then let the loop see the stop signal
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            # Clips can only be stacked with clips of the same shape
+            groups = {}
+            for request in batch:
+                groups.setdefault(tuple(request.frames.shape), []).append(request)
+            for requests in groups.values():
+                self._run_group(requests)
+
+    def _run_group(self, requests):
+        started = time.perf_counter()
+        try:
+            frames = torch.stack([request.frames for request in requests]).to(self.device)
+            with torch.no_grad():
+                outputs = self.model(frames)
+            if isinstance(outputs, torch.Tensor):
+                outputs = outputs.cpu()
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        compute_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._batches += 1
+            self._batch_sizes.append(len(requests))
+            for request in requests:
+                self._requests += 1
+                self._queue_ms.append((started - request.enqueued_at) * 1000)
+                self._compute_ms.append(compute_ms)
+
+        for i, request in enumerate(requests):
+            request.future.set_result({
+                'output': outputs[i],
+                'queue_ms': (started - request.enqueued_at) * 1000,
+                'compute_ms': compute_ms,
+                'batch_size': len(requests),
+            })
+
+    def stats(self):
+        with self._stats_lock:
+            queue_ms = list(self._queue_ms)
+            compute_ms = list(self._compute_ms)
+            batch_sizes = list(self._batch_sizes)
+            requests, batches = self._requests, self._batches
+
+        return {
+            'queue_depth': self._queue.qsize(),
+            'requests': requests,
+            'batches': batches,
+            'avg_batch_size': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'queue_ms': {'p50': _percentile(queue_ms, 50), 'p99': _percentile(queue_ms, 99)},
+            'compute_ms': {'p50': _percentile(compute_ms, 50), 'p99': _percentile(compute_ms, 99)},
+        }
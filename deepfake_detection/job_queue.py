@@ -0,0 +1,152 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class JobQueue:
+    def __init__(self, handler, num_workers=2, max_queue_size=32, result_ttl=600, db_path=None):
+        """
+        Background job queue served by a pool of worker threads.
+
+        Args:
+            handler (callable): Called with a job's payload, its return value becomes the job result.
+            num_workers (int): Number of worker threads.
+            max_queue_size (int): Jobs that may wait before submit() raises JobQueueFull.
+            result_ttl (float): Seconds a finished job is kept for polling.
+            db_path (str, optional): SQLite file the job states and results are kept in, so that every
+                process sharing it (e.g. gunicorn workers) can answer a poll. In memory when not given.
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self.db_path = db_path
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs = {}
+        self._db = None
+        self._lock = threading.Lock()
+        self._busy_workers = 0
+        self._busy_seconds = 0.0
+        self._completed = 0
+        self._failed = 0
+        self._started_at = time.monotonic()
+        self._workers = [
+            threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _connection(self):
+        # Called with the lock held. The queue is created in the serving process, never before a fork
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                             "result TEXT, error TEXT, submitted_at REAL NOT NULL, finished_at REAL)")
+            self._db.commit()
+        return self._db
+
+    def _save(self, job_id, job):
+        # Called with the lock held
+        self._jobs[job_id] = job
+        if self.db_path:
+            db = self._connection()
+            db.execute("INSERT OR REPLACE INTO jobs (job_id, status, result, error, submitted_at, finished_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       (job_id, job['status'], json.dumps(job['result']), job['error'],
+                        job['submitted_at'], job['finished_at']))
+            db.commit()
+
+    def _delete(self, job_id):
+        # Called with the lock held
+        del self._jobs[job_id]
+        if self.db_path:
+            db = self._connection()
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            db.commit()
+
+    def submit(self, payload):
+        """Queues a payload and returns its job ID. Raises JobQueueFull when the queue is at capacity."""
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = {'status': 'queued', 'result': None, 'error': None,
+               'submitted_at': time.time(), 'finished_at': None}
+        with self._lock:
+            self._save(job_id, job)
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                self._delete(job_id)
+            raise JobQueueFull("Too many jobs in the queue, try again later")
+        return job_id
+
+    def get(self, job_id):
+        """Returns a copy of the job's status, result and error, or None for an unknown ID."""
+        with self._lock:
+            if not self.db_path:
+                job = self._jobs.get(job_id)
+                return dict(job) if job is not None else None
+            # The job may have been submitted to another process sharing the database
+            row = self._connection().execute(
+                "SELECT status, result, error, submitted_at, finished_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'result': json.loads(row[1]) if row[1] is not None else None, 'error': row[2],
+                'submitted_at': row[3], 'finished_at': row[4]}
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] is not None and job['finished_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            if self.db_path:
+                # Also expires the jobs of processes that have since exited
+                db = self._connection()
+                db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+                db.commit()
+
+    def _run(self):
+        while True:
+            job_id, payload = self._queue.get()
+            with self._lock:
+                self._save(job_id, dict(self._jobs[job_id], status='running'))
+                self._busy_workers += 1
+
+            started = time.monotonic()
+            try:
+                result, error, status = self.handler(payload), None, 'done'
+            except Exception as e:
+                result, error, status = None, str(e), 'failed'
+
+            with self._lock:
+                self._save(job_id, dict(self._jobs[job_id], status=status, result=result, error=error,
+                                        finished_at=time.time()))
+                self._busy_workers -= 1
+                self._busy_seconds += time.monotonic() - started
+                if status == 'done':
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def stats(self):
+        with self._lock:
+            uptime = time.monotonic() - self._started_at
+            return {
+                'queue_length': self._queue.qsize(),
+                'max_queue_size': self._queue.maxsize,
+                'workers': self.num_workers,
+                'busy_workers': self._busy_workers,
+                'utilization': self._busy_workers / self.num_workers,
+                'lifetime_utilization': self._busy_seconds / (uptime * self.num_workers) if uptime > 0 else 0.0,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
@@ -0,0 +1,25 @@
+import json
+import os
+
+def read_jsonl(path):
+    """
+    Yields the entries of a JSONL journal that a resumable run appends to as work completes.
+
+    A run killed mid-write can leave a truncated last line, which is skipped. Nothing is
+    yielded when the journal does not exist yet.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def finished(entries, key='video'):
+    """Returns the `key` of every journal entry whose status is 'ok'."""
+    return {entry[key] for entry in entries if entry.get('status') == 'ok'}
@@ -0,0 +1,141 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """
+        Cumulative histogram in the Prometheus text format, one series per label set.
+
+        Args:
+            name (str): Metric name, e.g. 'deepfake_stage_seconds'.
+            documentation (str): HELP text.
+            buckets (tuple): Upper bounds of the buckets, +Inf is added automatically.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                # Buckets are stored per interval and summed here, Prometheus expects cumulative counts
+                for bound, cumulative in zip(self.buckets, itertools.accumulate(series['counts'])):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+STAGE_SECONDS = Histogram('deepfake_stage_seconds', "Time spent in each stage of a prediction.")
+REQUESTS = Counter('deepfake_requests_total', "Prediction requests by outcome.")
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block and records it under `stage` in deepfake_stage_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = STAGE_SECONDS.render() + REQUESTS.render()
+    return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    def __init__(self, every_n=0, output_dir='profiles'):
+        """
+        Runs torch.profiler on every Nth request and writes a Chrome trace per profiled request.
+
+        Args:
+            every_n (int): Profile one request out of every_n, 0 disables profiling.
+            output_dir (str): Directory the traces are written to, open them in chrome://tracing or Perfetto.
+        """
+        self.every_n = every_n
+        self.output_dir = output_dir
+        self._requests = itertools.count(1)
+
+    def sample(self, name='request'):
+        """
+        Counts a request and returns its trace name when it is one to profile, else None.
+
+        torch.profiler only records the thread it is started on, so a sampled request must run
+        its forward pass on the calling thread rather than hand it to a worker thread.
+        """
+        if self.every_n <= 0:
+            return None
+        request_number = next(self._requests)
+        if request_number % self.every_n:
+            return None
+        return f"{name}_{request_number}"
+
+    def profile(self, trace_name):
+        """Profiles the block and writes its trace, or does nothing when trace_name is None."""
+        if trace_name is None:
+            return nullcontext()
+        return self._profile(trace_name)
+
+    @contextmanager
+    def _profile(self, trace_name):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+            yield
+        os.makedirs(self.output_dir, exist_ok=True)
+        trace_path = os.path.join(self.output_dir, f"{trace_name}_{os.getpid()}.json")
+        profiler.export_chrome_trace(trace_path)
+        print(f"Wrote profiler trace to {trace_path}")
@@ -0,0 +1,104 @@
+import gc
+import threading
+import time
+
+import torch
+
+from resnet_lstm_model import ResNetLSTMModel
+from resnext_lstm_model import SimpleResNetLSTMModel
+
+ARCHITECTURES = {
+    'resnet': (ResNetLSTMModel, 'resnet'),
+    'resnext': (SimpleResNetLSTMModel, 'resnext'),
+}
+
+def load_state_dict(checkpoint):
+    """
+    Loads a state dict memory-mapped, so its pages come straight from the page cache and
+    are shared by every process that maps the same file.
+    """
+    try:
+        return torch.load(checkpoint, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 has no mmap loading
+        return torch.load(checkpoint, map_location='cpu')
+
+def load_model(arch, checkpoint=None):
+    """
+    Builds a detector in eval mode. With a checkpoint the ImageNet weights are not downloaded,
+    since the checkpoint overwrites them, and the parameters point into the mmapped file.
+    """
+    model_class, _ = ARCHITECTURES[arch]
+    model = model_class(pretrained=checkpoint is None)
+    if checkpoint:
+        state_dict = load_state_dict(checkpoint)
+        try:
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(state_dict)
+    return model.eval()
+
+def memory_usage_mb():
+    """
+    Returns the resident memory of this process, split into memory shared with other processes
+    (page cache, copy-on-write pages from the parent) and private memory. Linux only.
+    """
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:', 'Private_Clean:', 'Private_Dirty:'):
+                    usage[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return {}
+    return {
+        'rss_mb': usage.get('Rss', 0.0),
+        'pss_mb': usage.get('Pss', 0.0),
+        'shared_mb': usage.get('Shared_Clean', 0.0) + usage.get('Shared_Dirty', 0.0),
+        'private_mb': usage.get('Private_Clean', 0.0) + usage.get('Private_Dirty', 0.0),
+    }
+
+class ModelRegistry:
+    """
+    Loads models on first use and keeps one instance per name.
+
+    Call preload() in the master process before forking workers (e.g. gunicorn --preload):
+    the workers then share the mmapped weights and, thanks to gc.freeze(), the module
+    objects stay copy-on-write instead of being dirtied by the garbage collector.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._models = {}
+        self._load_seconds = {}
+        # Reentrant, a factory may get() the models it is built from
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                started = time.perf_counter()
+                self._models[name] = self._factories[name]()
+                self._load_seconds[name] = time.perf_counter() - started
+                print(f"Loaded model '{name}' in {self._load_seconds[name]:.2f}s")
+            return self._models[name]
+
+    def preload(self):
+        for name in self._factories:
+            self.get(name)
+        gc.freeze()
+
+    def stats(self):
+        return {
+            'loaded': sorted(self._models),
+            'registered': sorted(self._factories),
+            'load_seconds': dict(self._load_seconds),
+            'memory': memory_usage_mb(),
+        }
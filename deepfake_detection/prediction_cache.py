@@ -0,0 +1,101 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def make_key(content_hash, checkpoint_hash, num_frames):
+    return f"{content_hash}:{checkpoint_hash}:{num_frames}"
+
+class PredictionCache:
+    def __init__(self, max_entries=10000, ttl=3600, disk_path=None):
+        """
+        Two-tier cache of prediction results keyed by make_key().
+
+        Args:
+            max_entries (int): Entries kept in the in-memory LRU tier.
+            ttl (float): Seconds an entry stays valid in either tier.
+            disk_path (str, optional): SQLite file for an on-disk tier that survives restarts.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk_path = disk_path
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        # Opened on first use in every process: an SQLite connection must not cross a fork
+        # (gunicorn --preload creates the cache in the master)
+        if self.disk_path is None:
+            return None
+        if self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT value, created FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if now - row[1] <= self.ttl:
+                        value = json.loads(row[0])
+                        # Promote disk hits so repeats are served from memory
+                        self._remember(key, value, row[1])
+                        self.disk_hits += 1
+                        return value
+                    db.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                    db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Stores a JSON-serializable value under key in both tiers."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, value, created)
+            db = self._connection()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                           (key, json.dumps(value), created))
+                db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
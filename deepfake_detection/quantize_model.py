@@ -0,0 +1,132 @@
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader, Subset
+
+from dataset import DeepFakeDataset
+from export_model import ARCHITECTURES, build_model
+from train import feature_transform, train_labels, validate
+
+class QuantizedDetector(nn.Module):
+    """Detector with a statically quantized int8 backbone and a dynamically quantized LSTM+fc head."""
+
+    def __init__(self, backbone, lstm, fc):
+        super(QuantizedDetector, self).__init__()
+        self.backbone = backbone
+        self.lstm = lstm
+        self.fc = fc
+
+    def extract_features(self, x):
+        batch_size, num_frames, c, h, w = x.size()
+        features = self.backbone(x.reshape(batch_size * num_frames, c, h, w))
+        return features.reshape(batch_size, num_frames, -1)
+
+    def classify(self, features):
+        lstm_out, _ = self.lstm(features)
+        return self.fc(lstm_out[:, -1, :])
+
+    def forward(self, x):
+        return self.classify(self.extract_features(x))
+
+def quantize_detector(model, arch, calibration_loader, num_batches=None):
+    """
+    Applies static int8 quantization to the conv backbone and dynamic int8 to the head.
+
+    The backbone observers are calibrated on clips from `calibration_loader`.
+    """
+    _, backbone_attr = ARCHITECTURES[arch]
+    model = copy.deepcopy(model).eval()
+
+    backbone = getattr(model, backbone_attr)
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(backbone, qconfig_mapping, example_inputs=(torch.randn(1, 3, 224, 224),))
+
+    with torch.no_grad():
+        for batch_idx, (frames, _) in enumerate(calibration_loader):
+            if num_batches is not None and batch_idx >= num_batches:
+                break
+            prepared(frames.reshape(-1, *frames.shape[2:]))
+    quantized_backbone = convert_fx(prepared)
+
+    head = quantize_dynamic(nn.ModuleDict({'lstm': model.lstm, 'fc': model.fc}),
+                            {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    return QuantizedDetector(quantized_backbone, head['lstm'], head['fc']).eval()
+
+def measure_latency(model, num_frames=10, runs=20, warmup=3):
+    """Returns the median latency in milliseconds of one clip (batch size 1)."""
+    frames = torch.randn(1, num_frames, 3, 224, 224)
+    timings = []
+    with torch.no_grad():
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            model(frames)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def size_on_disk_mb(model):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'model.pth')
+        torch.save(model.state_dict(), path)
+        return os.path.getsize(path) / 2**20
+
+def build_report(fp32_model, int8_model, eval_loader, num_frames=10):
+    criterion = nn.BCEWithLogitsLoss()
+    cpu = torch.device('cpu')
+    report = {}
+    for name, model in (('fp32', fp32_model), ('int8', int8_model)):
+        val_loss, accuracy = validate(model, eval_loader, criterion, cpu)
+        report[name] = {
+            'val_loss': val_loss,
+            'accuracy': accuracy,
+            'latency_ms_per_clip': measure_latency(model, num_frames=num_frames),
+            'size_mb': size_on_disk_mb(model),
+        }
+    report['speedup'] = report['fp32']['latency_ms_per_clip'] / report['int8']['latency_ms_per_clip']
+    report['size_ratio'] = report['fp32']['size_mb'] / report['int8']['size_mb']
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-training int8 quantization of a deepfake detector")
+    parser.add_argument('--arch', choices=sorted(ARCHITECTURES), default='resnext')
+    parser.add_argument('--checkpoint', help="State dict to quantize")
+    parser.add_argument('--frames-dir', required=True, help="Directory containing the real/ and fake/ frame folders")
+    parser.add_argument('--calibration-samples', type=int, default=32)
+    parser.add_argument('--eval-samples', type=int, default=128)
+    parser.add_argument('--output', default='model_int8.pt', help="TorchScript file for the quantized model")
+    parser.add_argument('--report', default='quantization_report.json')
+    args = parser.parse_args()
+
+    dataset = DeepFakeDataset(frames_dir=args.frames_dir, labels=train_labels, transform=feature_transform, num_frames=10)
+    indices = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(0)).tolist()
+    calibration_set = Subset(dataset, indices[:args.calibration_samples])
+    eval_set = Subset(dataset, indices[args.calibration_samples:args.calibration_samples + args.eval_samples])
+    if len(eval_set) == 0:
+        # Small datasets: evaluate on the calibration clips rather than on nothing
+        eval_set = calibration_set
+
+    fp32_model = build_model(args.arch, args.checkpoint)
+    int8_model = quantize_detector(fp32_model, args.arch, DataLoader(calibration_set, batch_size=4))
+
+    with torch.no_grad():
+        scripted = torch.jit.trace(int8_model, torch.randn(1, 10, 3, 224, 224))
+    scripted.save(args.output)
+    print(f"Saved quantized model to {args.output}")
+
+    report = build_report(fp32_model, int8_model, DataLoader(eval_set, batch_size=4))
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name in ('fp32', 'int8'):
+        r = report[name]
+        print(f"{name}: accuracy {r['accuracy']:.2f}%, {r['latency_ms_per_clip']:.1f} ms/clip, {r['size_mb']:.1f} MB")
+    print(f"Speedup {report['speedup']:.2f}x, size reduction {report['size_ratio']:.2f}x. Report written to {args.report}")
@@ -1,13 +1,15 @@
 import torch
 import torch.nn as nn
 import torchvision.models as models
+from backbone import forward_backbone
 
 class ResNetLSTMModel(nn.Module):
-    def __init__(self, num_classes=1):
+    def __init__(self, num_classes=1, channels_last=False, pretrained=True):
         super(ResNetLSTMModel, self).__init__()
         
         # Load pre-trained ResNet
-        self.resnet = models.resnet50(weights="IMAGENET1K_V1")
+        # Skip the ImageNet weights when a checkpoint will overwrite them anyway
+        self.resnet = models.resnet50(weights="IMAGENET1K_V1" if pretrained else None)
         
         # Freeze early layers
         for param in list(self.resnet.parameters())[:-2]:
@@ -17,6 +19,11 @@ class ResNetLSTMModel(nn.Module):
         feature_size = self.resnet.fc.in_features
         self.resnet.fc = nn.Identity()
         
+        # Optionally run the convolutions in NHWC, which is faster on Tensor Cores and oneDNN
+        self.channels_last = channels_last
+        if channels_last:
+            self.resnet = self.resnet.to(memory_format=torch.channels_last)
+        
         # LSTM configuration
         self.lstm = nn.LSTM(
             input_size=feature_size,
@@ -30,16 +37,18 @@ class ResNetLSTMModel(nn.Module):
         # Fully connected layer for classification
         self.fc = nn.Linear(512, num_classes)
         
-    def forward(self, x):
+    def extract_features(self, x):
         batch_size, num_frames, c, h, w = x.size()
         
         # Process each frame through ResNet
         x = x.view(batch_size * num_frames, c, h, w)
-        features = self.resnet(x)
+        # The frozen trunk runs without autograd, only the trainable tail keeps activations
+        features = forward_backbone(self.resnet, x, self.channels_last)
         
         # Reshape for LSTM
-        features = features.view(batch_size, num_frames, -1)
+        return features.view(batch_size, num_frames, -1)
         
+    def classify(self, features):
         # Pass through LSTM
         lstm_out, _ = self.lstm(features)
         
@@ -49,4 +58,14 @@ class ResNetLSTMModel(nn.Module):
         # Pass through final FC layer
         output = self.fc(final_out)
         
-        return output 
\ No newline at end of file
+        return output
+        
+    def classify_step(self, features, state=None):
+        # Run the LSTM over a chunk of frames, carrying (h, c) over from the previous chunk
+        lstm_out, state = self.lstm(features, state)
+        
+        # One logit per frame, each one is the prediction for the clip seen so far
+        return self.fc(lstm_out).squeeze(-1), state
+        
+    def forward(self, x):
+        return self.classify(self.extract_features(x)) 
\ No newline at end of file
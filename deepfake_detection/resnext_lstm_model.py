@@ -1,14 +1,16 @@
 import torch
 import torch.nn as nn
 import torchvision.models as models
+from backbone import forward_backbone
 from dataloader import initialize_data_loaders
 
 class SimpleResNetLSTMModel(nn.Module):
-    def __init__(self, num_classes=1):
+    def __init__(self, num_classes=1, channels_last=False, pretrained=True):
         super(SimpleResNetLSTMModel, self).__init__()
         
         # Load pre-trained ResNeXt
-        self.resnext = models.resnext50_32x4d(weights="IMAGENET1K_V1")
+        # Skip the ImageNet weights when a checkpoint will overwrite them anyway
+        self.resnext = models.resnext50_32x4d(weights="IMAGENET1K_V1" if pretrained else None)
         
         # Freeze early layers
         for param in list(self.resnext.parameters())[:-2]:
@@ -18,6 +20,11 @@ class SimpleResNetLSTMModel(nn.Module):
         feature_size = self.resnext.fc.in_features
         self.resnext.fc = nn.Identity()
         
+        # Optionally run the convolutions in NHWC, which is faster on Tensor Cores and oneDNN
+        self.channels_last = channels_last
+        if channels_last:
+            self.resnext = self.resnext.to(memory_format=torch.channels_last)
+        
         # Simpler LSTM configuration matching the saved model
         self.lstm = nn.LSTM(
             input_size=feature_size,
@@ -31,16 +38,18 @@ class SimpleResNetLSTMModel(nn.Module):
         # Simple FC layer instead of attention and complex classifier
         self.fc = nn.Linear(512, num_classes)  # Changed from complex classifier
         
-    def forward(self, x):
+    def extract_features(self, x):
         batch_size, num_frames, c, h, w = x.size()
         
         # Process each frame through ResNeXt
         x = x.view(batch_size * num_frames, c, h, w)
-        features = self.resnext(x)
+        # The frozen trunk runs without autograd, only the trainable tail keeps activations
+        features = forward_backbone(self.resnext, x, self.channels_last)
         
         # Reshape for LSTM
-        features = features.view(batch_size, num_frames, -1)
+        return features.view(batch_size, num_frames, -1)
         
+    def classify(self, features):
         # Pass through LSTM
         lstm_out, _ = self.lstm(features)
         
@@ -51,6 +60,9 @@ class SimpleResNetLSTMModel(nn.Module):
         output = self.fc(final_out)
         
         return output
+        
+    def forward(self, x):
+        return self.classify(self.extract_features(x))
 
 if __name__ == "__main__":
     # Test the model
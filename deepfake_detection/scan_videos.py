@@ -0,0 +1,210 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import torch
+
+from data_preprocessing import load_and_preprocess_video
+from export_model import load_exported_model
+from journal import finished, read_jsonl
+from model_registry import ARCHITECTURES, load_model
+
+OUTPUT_FIELDS = ('video', 'status', 'prediction', 'confidence', 'frames', 'error')
+
+def expand_inputs(patterns=(), manifest=None, videos_root=None):
+    """
+    Returns the video paths matched by glob patterns (recursive, '**' allowed) and listed in a manifest.
+
+    The manifest is a text file with one path per line, or a JSONL file whose entries have a
+    'video' key. Relative manifest paths are resolved against `videos_root`, or the manifest's
+    directory when it is not given. extract_corpus.py's manifest lists paths relative to its
+    videos_dir, so pass that as `videos_root`; its entries that failed to extract are skipped.
+    """
+    videos = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            print(f"No videos match {pattern}, skipping.")
+        videos.extend(path for path in matches if os.path.isfile(path))
+
+    if manifest:
+        root = videos_root or os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            is_jsonl = next((line.strip() for line in f if line.strip()), '').startswith('{')
+        if is_jsonl:
+            paths = [entry['video'] for entry in read_jsonl(manifest) if entry.get('status', 'ok') == 'ok']
+        else:
+            with open(manifest) as f:
+                paths = [line.strip() for line in f if line.strip()]
+        videos.extend(path if os.path.isabs(path) else os.path.join(root, path) for path in paths)
+
+    # Keep the first occurrence of each video, in input order
+    return list(dict.fromkeys(videos))
+
+def load_finished(output_path):
+    """Returns the videos that already have a successful result in output_path."""
+    if not output_path.endswith('.csv'):
+        return finished(read_jsonl(output_path))
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, newline='') as f:
+        return finished(csv.DictReader(f))
+
+class ResultWriter:
+    def __init__(self, output_path):
+        """Appends results to a JSONL file, or to a CSV file if output_path ends in .csv."""
+        self._csv = output_path.endswith('.csv')
+        write_header = self._csv and (not os.path.exists(output_path) or os.path.getsize(output_path) == 0)
+        self._file = open(output_path, 'a', newline='')
+        if self._csv:
+            self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS, extrasaction='ignore')
+            if write_header:
+                self._writer.writeheader()
+
+    def write(self, entry):
+        if self._csv:
+            self._writer.writerow(entry)
+        else:
+            self._file.write(json.dumps(entry) + '\n')
+        # Flushed per result so an interrupted scan loses nothing it has reported
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def _init_decoder():
+    # One decoding process per core, so each one keeps torch to a single thread
+    torch.set_num_threads(1)
+
+def decode_video(video, num_frames, face_crop=False, adaptive=False):
+    """Decodes and preprocesses one video in a worker process."""
+    try:
+        frames = load_and_preprocess_video(video, num_frames=num_frames, face_crop=face_crop, adaptive=adaptive)
+        return video, frames.numpy(), None
+    except Exception as e:
+        return video, None, str(e)
+
+def build_scanner_model(arch='resnet', checkpoint=None, artifact=None, device='cpu'):
+    if artifact:
+        # Exported artifacts run on the CPU, like in app.py
+        return load_exported_model(artifact), torch.device('cpu')
+    return load_model(arch, checkpoint).to(device), torch.device(device)
+
+def scan_videos(videos, model, device, output_path, num_frames=10, batch_size=8, num_workers=None,
+                threshold=0.5, face_crop=False, adaptive=False, report_every=100):
+    """
+    Classifies videos in bulk: decoding runs on a process pool and clips are batched into the model.
+
+    Results are appended to output_path as they complete, and videos that already have a
+    successful result there are skipped, so an interrupted scan can simply be rerun.
+
+    Returns:
+        dict: Number of videos classified, failures and throughput.
+    """
+    done = load_finished(output_path)
+    pending = [video for video in videos if video not in done]
+    print(f"{len(videos) - len(pending)} videos already classified, {len(pending)} to go")
+
+    writer = ResultWriter(output_path)
+    classified, failed = 0, 0
+    # Clips are grouped by frame count, short videos decode fewer frames and cannot share a batch
+    batches = {}
+    start = time.perf_counter()
+
+    def report():
+        elapsed = time.perf_counter() - start
+        print(f"{classified + failed}/{len(pending)} videos, {classified / elapsed:.2f} videos/sec")
+
+    def run_batch(clips):
+        nonlocal classified
+        frames = torch.stack([torch.from_numpy(clip) for _, clip in clips]).to(device)
+        with torch.no_grad():
+            confidences = torch.sigmoid(model(frames)).view(-1).tolist()
+        for (video, clip), confidence in zip(clips, confidences):
+            writer.write({
+                'video': video,
+                'status': 'ok',
+                'prediction': "Fake" if confidence > threshold else "Real",
+                'confidence': confidence,
+                'frames': clip.shape[0],
+                'error': None
+            })
+            classified += 1
+            if (classified + failed) % report_every == 0:
+                report()
+
+    try:
+        num_workers = num_workers or os.cpu_count()
+        # Bound the decoded clips waiting in memory when the model is slower than decoding
+        max_in_flight = 4 * num_workers + batch_size
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_decoder) as executor:
+            videos_iter = iter(pending)
+            in_flight = set()
+            while True:
+                for video in videos_iter:
+                    in_flight.add(executor.submit(decode_video, video, num_frames, face_crop, adaptive))
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    video, clip, error = future.result()
+                    if error is not None:
+                        failed += 1
+                        print(f"Failed to decode {video}: {error}")
+                        writer.write({'video': video, 'status': 'error', 'error': error})
+                        continue
+                    batch = batches.setdefault(clip.shape[0], [])
+                    batch.append((video, clip))
+                    if len(batch) == batch_size:
+                        run_batch(batches.pop(clip.shape[0]))
+
+            for clips in batches.values():
+                run_batch(clips)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'videos': classified,
+        'failed': failed,
+        'seconds': elapsed,
+        'videos_per_sec': classified / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"Classified {classified} videos ({failed} failed) in {elapsed:.1f}s: "
+          f"{summary['videos_per_sec']:.2f} videos/sec")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify many videos offline and stream the results to JSONL or CSV")
+    parser.add_argument('patterns', nargs='*', help="Video paths or glob patterns, e.g. 'backlog/**/*.mp4'")
+    parser.add_argument('--manifest', help="File listing videos, one path per line or JSONL entries with a 'video' key")
+    parser.add_argument('--videos-root', help="Directory relative manifest paths are resolved against "
+                                              "(default: the manifest's directory), e.g. extract_corpus.py's videos_dir")
+    parser.add_argument('--output', required=True, help="Results file, CSV if it ends in .csv, JSONL otherwise")
+    parser.add_argument('--arch', choices=sorted(ARCHITECTURES), default='resnet')
+    parser.add_argument('--checkpoint', help="State dict of the trained detector")
+    parser.add_argument('--artifact', help="TorchScript/ONNX model written by export_model.py, instead of --checkpoint")
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--num-frames', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help="Decoding processes (default: CPU count)")
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--face-crop', action='store_true', help="Crop frames to the tracked face")
+    parser.add_argument('--adaptive', action='store_true', help="Keep the most informative frames instead of fixed intervals")
+    args = parser.parse_args()
+
+    if not args.patterns and not args.manifest:
+        parser.error("pass video paths/globs or --manifest")
+
+    videos = expand_inputs(args.patterns, args.manifest, args.videos_root)
+    model, device = build_scanner_model(args.arch, args.checkpoint, args.artifact, args.device)
+    scan_videos(videos, model, device, args.output, num_frames=args.num_frames, batch_size=args.batch_size,
+                num_workers=args.workers, threshold=args.threshold, face_crop=args.face_crop,
+                adaptive=args.adaptive)
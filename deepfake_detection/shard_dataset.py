@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from dataset import DeepFakeDataset
+
+# Per-shard index rows: sample offset inside the shard and its label
+INDEX_DTYPE = np.dtype([('offset', np.int64), ('label', np.int64)])
+
+def _list_videos(frames_dir, labels, num_frames, face_crop=False):
+    """Returns (frame_paths, label, face_boxes) for every video folder with at least num_frames frames."""
+    dataset = DeepFakeDataset(frames_dir, labels, num_frames=num_frames, face_crop=face_crop)
+    return [(frame_paths, label, dataset.data.face_boxes(idx)) for idx, (frame_paths, label) in enumerate(dataset.data)]
+
+def _decode_video(frame_paths, size, boxes=None):
+    # Resized once here instead of on every epoch, same bilinear filter as transforms.Resize
+    frames = []
+    for i, frame_path in enumerate(frame_paths):
+        image = Image.open(frame_path).convert('RGB')
+        if boxes is not None and boxes[i] is not None:
+            x, y, w, h = boxes[i]
+            image = image.crop((x, y, x + w, y + h))
+        frames.append(np.asarray(image.resize((size[1], size[0]), Image.BILINEAR)))
+    return np.stack(frames)
+
+class _ShardWriter:
+    """Streams samples into consecutive shard files, so only the sample being written is in memory."""
+
+    def __init__(self, output_dir, samples_per_shard):
+        self.output_dir = output_dir
+        self.samples_per_shard = samples_per_shard
+        self.num_shards = 0
+        self._file = None
+        self._labels = []
+
+    def add(self, frames, label):
+        if self._file is None:
+            self._file = open(os.path.join(self.output_dir, f'shard_{self.num_shards:05d}.u8'), 'wb')
+        self._file.write(np.ascontiguousarray(frames).tobytes())
+        self._labels.append(label)
+        if len(self._labels) == self.samples_per_shard:
+            self._finish_shard()
+
+    def _finish_shard(self):
+        self._file.close()
+        index = np.zeros(len(self._labels), dtype=INDEX_DTYPE)
+        index['offset'] = np.arange(len(self._labels))
+        index['label'] = self._labels
+        np.save(os.path.join(self.output_dir, f'shard_{self.num_shards:05d}.idx.npy'), index)
+        self.num_shards += 1
+        self._file, self._labels = None, []
+
+    def close(self):
+        if self._file is not None:
+            self._finish_shard()
+
+def pack_shards(frames_dir, labels, output_dir, num_frames=10, size=(224, 224),
+                samples_per_shard=256, num_workers=8, face_crop=False):
+    """
+    Packs the `real`/`fake` frame folders into fixed-shape uint8 shards.
+
+    Every shard holds up to `samples_per_shard` samples of shape (num_frames, height, width, 3),
+    stored back to back, next to an index file with each sample's offset and label. With
+    `face_crop` the frames are cropped to the face boxes cached in the dataset manifest.
+
+    Returns:
+        int: Number of samples written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    videos = _list_videos(frames_dir, labels, num_frames, face_crop)
+
+    writer = _ShardWriter(output_dir, samples_per_shard)
+    # Videos are decoded a chunk at a time and written as they come, so memory holds one chunk, not a shard
+    chunk_size = 2 * num_workers
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for start in range(0, len(videos), chunk_size):
+            chunk = videos[start:start + chunk_size]
+            for frames, label in executor.map(lambda video: (_decode_video(video[0], size, video[2]), video[1]), chunk):
+                writer.add(frames, label)
+    writer.close()
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'num_frames': num_frames,
+            'height': size[0],
+            'width': size[1],
+            'num_shards': writer.num_shards,
+            'num_samples': len(videos),
+            'face_crop': face_crop,
+        }, f, indent=2)
+
+    print(f"Packed {len(videos)} videos into {writer.num_shards} shards in {output_dir}")
+    return len(videos)
+
+class ShardedDeepFakeDataset(Dataset):
+    def __init__(self, shards_dir, transform=None):
+        """
+        Args:
+            shards_dir (str): Directory written by pack_shards.
+            transform (callable, optional): A function/transform applied to each frame as a PIL image.
+                Without one, samples are returned as float tensors in [0, 1], like ToTensor.
+        """
+        self.shards_dir = shards_dir
+        self.transform = transform
+
+        with open(os.path.join(shards_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_frames = meta['num_frames']
+        self.face_crop = meta.get('face_crop', False)
+        self.sample_shape = (meta['num_frames'], meta['height'], meta['width'], 3)
+
+        # One global table of (shard, offset, label) makes random access O(1)
+        shard_ids, offsets, labels = [], [], []
+        for shard_id in range(meta['num_shards']):
+            index = np.load(os.path.join(shards_dir, f'shard_{shard_id:05d}.idx.npy'))
+            shard_ids.append(np.full(len(index), shard_id, dtype=np.int64))
+            offsets.append(index['offset'])
+            labels.append(index['label'])
+        self.shard_ids = np.concatenate(shard_ids) if shard_ids else np.zeros(0, dtype=np.int64)
+        self.offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+        self.labels = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64)
+
+        self._shards = {}
+
+    def __getstate__(self):
+        # Each DataLoader worker maps the shards itself, the page cache is shared between them
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _shard(self, shard_id):
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            # Copy-on-write mapping gives writable views for torch.from_numpy without copying
+            shard = np.memmap(os.path.join(self.shards_dir, f'shard_{shard_id:05d}.u8'),
+                              dtype=np.uint8, mode='c').reshape((-1,) + self.sample_shape)
+            self._shards[shard_id] = shard
+        return shard
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            tuple: A tuple (frames_tensor, label) where frames_tensor has shape (num_frames, 3, height, width).
+        """
+        frames = self._shard(int(self.shard_ids[idx]))[int(self.offsets[idx])]
+        label = int(self.labels[idx])
+
+        if self.transform:
+            frames_tensor = torch.stack([self.transform(Image.fromarray(frame)) for frame in frames])
+        else:
+            frames_tensor = torch.from_numpy(frames).permute(0, 3, 1, 2).float().div_(255.0)
+
+        return frames_tensor, torch.tensor(label)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack real/fake frame folders into memory-mapped shards")
+    parser.add_argument('frames_dir', help="Directory containing the real/ and fake/ frame folders")
+    parser.add_argument('output_dir', help="Directory the shards are written to")
+    parser.add_argument('--num-frames', type=int, default=10)
+    parser.add_argument('--size', type=int, default=224)
+    parser.add_argument('--samples-per-shard', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--face-crop', action='store_true', help="Crop frames to the tracked face")
+    args = parser.parse_args()
+
+    pack_shards(
+        args.frames_dir,
+        {'real': 0, 'fake': 1},
+        args.output_dir,
+        num_frames=args.num_frames,
+        size=(args.size, args.size),
+        samples_per_shard=args.samples_per_shard,
+        num_workers=args.workers,
+        face_crop=args.face_crop
+    )
@@ -0,0 +1,63 @@
+import torch
+
+from data_preprocessing import iter_frame_chunks
+
+def stream_predict(model, filepath, chunk_size=4, sample_fps=2.0, max_frames=64,
+                   fake_threshold=0.9, real_threshold=0.1, patience=3, face_crop=False):
+    """
+    Classifies a video chunk by chunk and stops as soon as the answer is clear.
+
+    The LSTM state is carried between chunks, so after every frame the model has a
+    prediction for the clip seen so far. Inference stops once that confidence stays
+    at or above `fake_threshold` (or at or below `real_threshold`) for `patience`
+    consecutive frames, or after `max_frames` sampled frames.
+
+    Args:
+        model (ResNetLSTMModel): Model in eval mode.
+        filepath (str): Path to the video file.
+        chunk_size (int): Number of frames decoded and run through the backbone at once.
+        sample_fps (float): Frames sampled per second of video.
+        max_frames (int): Upper bound on the frames used for a single video.
+        fake_threshold (float): Confidence at or above which a frame votes Fake.
+        real_threshold (float): Confidence at or below which a frame votes Real.
+        patience (int): Consecutive agreeing frames needed to stop early.
+        face_crop (bool): Crop every frame to the tracked face before the backbone.
+
+    Returns:
+        dict: The final `confidence`, `frames_used` and whether the video `exited_early`.
+    """
+    device = next(model.parameters()).device
+    state = None
+    confidence = None
+    frames_used = 0
+    streak_side, streak = None, 0
+
+    chunks = iter_frame_chunks(filepath, chunk_size=chunk_size, sample_fps=sample_fps, max_frames=max_frames,
+                               face_crop=face_crop)
+    try:
+        with torch.no_grad():
+            for chunk in chunks:
+                features = model.extract_features(chunk.unsqueeze(0).to(device))
+                logits, state = model.classify_step(features, state)
+
+                for confidence in torch.sigmoid(logits[0]).tolist():
+                    frames_used += 1
+                    if confidence >= fake_threshold:
+                        side = 'fake'
+                    elif confidence <= real_threshold:
+                        side = 'real'
+                    else:
+                        side = None
+
+                    streak = streak + 1 if side is not None and side == streak_side else int(side is not None)
+                    streak_side = side
+                    if streak >= patience:
+                        return {'confidence': confidence, 'frames_used': frames_used, 'exited_early': True}
+    finally:
+        # Stops decoding and releases the capture when exiting early
+        chunks.close()
+
+    if confidence is None:
+        raise ValueError("No frames were successfully processed")
+
+    return {'confidence': confidence, 'frames_used': frames_used, 'exited_early': False}
@@ -0,0 +1,30 @@
+import math
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from torch.utils.data import DataLoader, TensorDataset
+
+from train import validate
+
+class _MeanLogit(torch.nn.Module):
+    # (batch, num_frames, features) -> (batch, 1), like the detectors
+    def forward(self, x):
+        return x.mean(dim=(1, 2)).unsqueeze(1)
+
+def test_validate_last_batch_of_one():
+    # 17 samples in batches of 4 leave a last batch with a single sample
+    features = torch.randn(17, 3, 5)
+    labels = torch.randint(0, 2, (17,))
+    loader = DataLoader(TensorDataset(features, labels), batch_size=4)
+
+    val_loss, accuracy = validate(_MeanLogit(), loader, torch.nn.BCEWithLogitsLoss(), torch.device('cpu'))
+
+    assert math.isfinite(val_loss)
+    assert 0.0 <= accuracy <= 100.0
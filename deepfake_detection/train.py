@@ -1,14 +1,43 @@
+import datetime
 import os
+import time
+from contextlib import nullcontext
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from torch.utils.data import DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler
 from torchvision import transforms
 from resnext_lstm_model import SimpleResNetLSTMModel  # Ensure this model file is available
 from dataset import DeepFakeDataset  # Ensure the correct path for DeepFakeDataset
+from shard_dataset import ShardedDeepFakeDataset
+from feature_cache import FeatureCache, CachedFeatureDataset, precompute_features
+from gpu_augment import ClipAugment
+from checkpointing import atomic_save, load_checkpoint, read_progress, save_checkpoint
+
+try:
+    import resource  # Peak RSS on CPU, not available on Windows
+except ImportError:
+    resource = None
+
+# Distributed training, set up by torchrun, e.g.
+#   torchrun --nproc_per_node=4 train.py
+# Without GPUs the processes use the gloo backend on the CPU
+world_size = int(os.environ.get('WORLD_SIZE', 1))
+rank = int(os.environ.get('RANK', 0))
+local_rank = int(os.environ.get('LOCAL_RANK', 0))
+distributed = world_size > 1
+dist_backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+# The other ranks wait in a barrier while rank 0 indexes the corpus, detects faces and caches features on
+# first use, which takes far longer than the default process-group timeout (10 min NCCL, 30 min gloo)
+dist_timeout_minutes = 12 * 60
 
 # Device configuration
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+if torch.cuda.is_available():
+    device = torch.device(f"cuda:{local_rank}" if distributed else "cuda")
+else:
+    device = torch.device("cpu")
 
 # Hyperparameters
 batch_size = 16  # Reduced batch size for better generalization
@@ -16,6 +45,30 @@ learning_rate = 0.0001
 num_epochs = 100
 weight_decay = 0.01  # Add L2 regularization
 
+# Mixed precision (fp16 with gradient scaling on CUDA, bf16 on CPU) and gradient accumulation
+use_amp = False
+amp_dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+accumulation_steps = 1  # Effective batch size is batch_size * accumulation_steps
+use_channels_last = False  # NHWC convolutions in the backbone
+
+# Checkpointing, resume and early stopping
+checkpoint_dir = 'checkpoints'
+checkpoint_every = 1  # Epochs between periodic checkpoints
+resume = True  # Continue from checkpoint_dir/latest.pth when it exists
+early_stopping_patience = 10  # Epochs without a better validation loss before stopping
+
+# Input pipeline
+num_workers = 4  # DataLoader worker processes, 0 loads on the main process
+prefetch_factor = 2  # Batches prefetched per worker
+persistent_workers = True  # Keep workers alive between epochs
+pin_memory = device.type == 'cuda'  # Page-locked batches for async host-to-device copies
+gpu_augmentation = False  # Clip-consistent batched augmentation on the device instead of per-frame PIL
+face_crop = False  # Crop frames to the tracked face, boxes are cached in the dataset manifest
+
+# Train only the LSTM+fc head on cached backbone features (the backbone is frozen)
+use_feature_cache = False
+feature_cache_dir = 'feature_cache'
+
 # Data transformations
 transform = transforms.Compose([
     transforms.RandomHorizontalFlip(),
@@ -25,66 +78,209 @@ transform = transforms.Compose([
     transforms.ToTensor(),  # Convert to tensor
 ])
 
+# Deterministic transform, used when caching backbone features and with gpu_augmentation
+feature_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+])
+
+# Specify the paths to your frame directories
+train_frames_dir = 'E:/Project/deepfake detection/data/frames'  # Modify this to your data path
+train_labels = {
+    'real': 0,
+    'fake': 1,
+}
+# Set to a directory written by shard_dataset.py to read pre-decoded shards instead of JPEGs
+train_shards_dir = None
+split_seed = 42  # Every rank must make the same train/validation split
+
+def setup_distributed():
+    if not distributed:
+        return
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+    dist.init_process_group(backend=dist_backend, rank=rank, world_size=world_size,
+                            timeout=datetime.timedelta(minutes=dist_timeout_minutes))
+
+def cleanup_distributed():
+    if distributed and dist.is_initialized():
+        dist.destroy_process_group()
+
+def is_main_process():
+    return rank == 0
+
+def log(message):
+    # Only rank 0 logs, other ranks would print the same lines
+    if is_main_process():
+        print(message)
+
+def _make_loader(dataset, shuffle):
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=shuffle) if distributed else None
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle and sampler is None, sampler=sampler,
+                      **_loader_kwargs())
+
+def _build_dataset(**kwargs):
+    # Rank 0 indexes the frames (and detects faces) into the manifest first, the other ranks then read it
+    if distributed and not is_main_process():
+        dist.barrier()
+    try:
+        return DeepFakeDataset(**kwargs)
+    finally:
+        # Released even when indexing fails, the other ranks then hit the same error instead of hanging
+        if distributed and is_main_process():
+            dist.barrier()
+
+def _split(dataset):
+    train_size = int(0.8 * len(dataset))
+    val_size = len(dataset) - train_size
+    return torch.utils.data.random_split(dataset, [train_size, val_size],
+                                         generator=torch.Generator().manual_seed(split_seed))
+
+class _HeadOnly(nn.Module):
+    # Routes cached features through classify() while keeping a forward() for DistributedDataParallel
+    def __init__(self, model):
+        super(_HeadOnly, self).__init__()
+        self.model = model
+
+    def forward(self, features):
+        return self.model.classify(features)
+
+def _loader_kwargs():
+    kwargs = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if num_workers > 0:
+        kwargs.update(prefetch_factor=prefetch_factor, persistent_workers=persistent_workers)
+    return kwargs
+
 # Load training data function
 def load_training_data():
     try:
-        print("Loading training data...")
-        # Specify the paths to your frame directories
-        train_frames_dir = 'E:/Project/deepfake detection/data/frames'  # Modify this to your data path
-        labels = {
-            'real': 0,
-            'fake': 1,
-        }
+        log("Loading training data...")
+        # With gpu_augmentation the workers only resize, the random augmentations run on the device
+        data_transform = feature_transform if gpu_augmentation else transform
 
         # Create the dataset
-        dataset = DeepFakeDataset(
-            frames_dir=train_frames_dir,
-            labels=labels,
-            transform=transform,
-            num_frames=10  # Number of frames to sample per video
-        )
+        if train_shards_dir:
+            # Shards are pre-decoded at the model size: without random PIL augmentations the frames
+            # go straight from the memory map to a tensor
+            dataset = ShardedDeepFakeDataset(train_shards_dir, transform=None if gpu_augmentation else transform)
+            if dataset.face_crop != face_crop:
+                # Cropping happens when the shards are packed (shard_dataset.py --face-crop)
+                log(f"Warning: shards in {train_shards_dir} were packed with face_crop={dataset.face_crop}")
+        else:
+            dataset = _build_dataset(
+                frames_dir=train_frames_dir,
+                labels=train_labels,
+                transform=data_transform,
+                num_frames=10,  # Number of frames to sample per video
+                face_crop=face_crop
+            )
 
         # Split the dataset into train and validation
-        train_size = int(0.8 * len(dataset))
-        val_size = len(dataset) - train_size
-        train_dataset, val_dataset = torch.utils.data.random_split(dataset, [train_size, val_size])
+        train_dataset, val_dataset = _split(dataset)
 
-        # Create data loaders
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+        # Create data loaders, sharded across ranks when distributed
+        train_loader = _make_loader(train_dataset, shuffle=True)
+        val_loader = _make_loader(val_dataset, shuffle=False)
 
-        print("Training data loaded successfully.")
+        log("Training data loaded successfully.")
         return train_loader, val_loader
     except Exception as e:
         print(f"Error loading training data: {e}")
         return None, None
 
+# Load cached backbone features, running the backbone only for videos not cached yet
+def load_cached_feature_data():
+    try:
+        log("Loading cached feature data...")
+        dataset = _build_dataset(
+            frames_dir=train_frames_dir,
+            labels=train_labels,
+            transform=feature_transform,
+            num_frames=10,
+            face_crop=face_crop
+        )
+        # Features of face crops and of full frames are cached apart
+        backbone_name = 'resnext50_32x4d-faces' if face_crop else 'resnext50_32x4d'
+
+        # Only rank 0 writes the cache, the others wait and then read it
+        if is_main_process():
+            cache = FeatureCache(feature_cache_dir, backbone_name=backbone_name)
+            feature_model = SimpleResNetLSTMModel(num_classes=1).to(device)
+            precompute_features(feature_model, dataset, cache, device, batch_size=batch_size)
+            del feature_model
+        if distributed:
+            dist.barrier()
+        cache = FeatureCache(feature_cache_dir, backbone_name=backbone_name)
+
+        feature_dataset = CachedFeatureDataset(dataset, cache)
+        train_dataset, val_dataset = _split(feature_dataset)
+
+        train_loader = _make_loader(train_dataset, shuffle=True)
+        val_loader = _make_loader(val_dataset, shuffle=False)
+
+        log("Cached feature data loaded successfully.")
+        return train_loader, val_loader
+    except Exception as e:
+        print(f"Error loading cached feature data: {e}")
+        return None, None
+
+def _peak_memory_mb():
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and covers the whole process lifetime
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return float('nan')
+
+def _interrupted_run(num_epochs):
+    # best_model.pth is written from the first epoch on, so its presence does not mean training finished
+    latest_checkpoint = os.path.join(checkpoint_dir, 'latest.pth')
+    if not resume or not os.path.exists(latest_checkpoint):
+        return False
+    progress = read_progress(latest_checkpoint)
+    return (progress['epoch'] + 1 < num_epochs
+            and progress['epochs_without_improvement'] < early_stopping_patience)
+
 # Training function
 def train_model_if_needed(force_train=False, num_epochs=5):
     model_path = 'best_model.pth'
     
     if os.path.exists(model_path) and not force_train:
-        print("Pre-trained model found. Skipping training.")
-        return
+        if not _interrupted_run(num_epochs):
+            log("Pre-trained model found. Skipping training.")
+            return
+        log(f"Found an interrupted training run in {checkpoint_dir}, resuming it.")
     
-    print("Starting model training...")
+    log("Starting model training...")
 
     # Load data only when training
-    train_loader, val_loader = load_training_data()
+    if use_feature_cache:
+        train_loader, val_loader = load_cached_feature_data()
+    else:
+        train_loader, val_loader = load_training_data()
     
     if train_loader is None or len(train_loader) == 0:
-        print("No training data available. Skipping training.")
+        log("No training data available. Skipping training.")
         return
     
     try:
         # Initialize model and training components
-        print("Initializing model...")
-        model = SimpleResNetLSTMModel(num_classes=1).to(device)
+        log("Initializing model...")
+        model = SimpleResNetLSTMModel(num_classes=1, channels_last=use_channels_last).to(device)
+
+        # Cached features skip the backbone and go straight to the LSTM+fc head
+        train_module = _HeadOnly(model) if use_feature_cache else model
+        if distributed:
+            train_module = DistributedDataParallel(
+                train_module,
+                device_ids=[device.index] if device.type == 'cuda' else None
+            )
+
         criterion = nn.BCEWithLogitsLoss()  # Binary classification
         optimizer = optim.AdamW(model.parameters(), 
                                lr=learning_rate, 
                                weight_decay=weight_decay)
-        print("Model initialized.")
+        log("Model initialized.")
 
         # Add learning rate scheduler
         scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 
@@ -93,43 +289,121 @@ def train_model_if_needed(force_train=False, num_epochs=5):
                                                         patience=5, 
                                                         verbose=True)
 
+        clip_augment = ClipAugment().to(device) if gpu_augmentation and not use_feature_cache else None
+
+        # Loss scaling is only needed for fp16, bf16 has the same exponent range as fp32
+        scaler = torch.amp.GradScaler('cuda', enabled=use_amp and amp_dtype == torch.float16)
+
+        # validate() calls the module directly, so feature-cache mode needs the head-only wrapper
+        eval_module = _HeadOnly(model) if use_feature_cache else model
+
+        start_epoch = 0
+        best_val_loss = float('inf')
+        epochs_without_improvement = 0
+        latest_checkpoint = os.path.join(checkpoint_dir, 'latest.pth')
+        if _interrupted_run(num_epochs):
+            resumed = load_checkpoint(latest_checkpoint, model, optimizer, scheduler, scaler)
+            start_epoch = resumed['epoch'] + 1
+            best_val_loss = resumed['best_val_loss']
+            epochs_without_improvement = resumed['epochs_without_improvement']
+            log(f"Resumed from {latest_checkpoint} after epoch {start_epoch}")
+        elif resume and os.path.exists(latest_checkpoint):
+            # That run finished or stopped early, this one starts over and replaces its checkpoint
+            log(f"{latest_checkpoint} is from a finished run, starting a new one")
+
         # Training loop
-        for epoch in range(num_epochs):
+        for epoch in range(start_epoch, num_epochs):
             model.train()
+            if clip_augment is not None:
+                clip_augment.train()
             running_loss = 0.0
+            samples_seen = 0
+            if isinstance(train_loader.sampler, DistributedSampler):
+                train_loader.sampler.set_epoch(epoch)  # Reshuffle the shards every epoch
+            if device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats(device)
+            epoch_start = time.perf_counter()
+
+            optimizer.zero_grad()
             for batch_idx, (frames, labels) in enumerate(train_loader):
-                frames, labels = frames.to(device), labels.to(device)
-                optimizer.zero_grad()
+                frames = frames.to(device, non_blocking=pin_memory)
+                labels = labels.to(device, non_blocking=pin_memory)
+                if clip_augment is not None and frames.dim() == 5:
+                    frames = clip_augment(frames)
 
-                # Ensure the frames have the correct shape for the model
-                if frames.dim() != 5:  # Ensure it's (batch_size, num_frames, channels, height, width)
+                # Cached features are (batch_size, num_frames, feature_size), frames are 5-dimensional
+                if not use_feature_cache and frames.dim() != 5:  # Ensure it's (batch_size, num_frames, channels, height, width)
                     print(f"Warning: Input frame shape mismatch. Expected 5 dimensions, got {frames.dim()}")
                     continue
 
-                # Forward pass
-                outputs = model(frames)  # Outputs should have shape [batch_size, 1]
+                step = (batch_idx + 1) % accumulation_steps == 0 or batch_idx + 1 == len(train_loader)
+                # DDP only all-reduces the gradients on the micro-batch the optimizer steps on
+                sync = train_module.no_sync() if distributed and not step else nullcontext()
+                with sync:
+                    with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp):
+                        # Forward pass
+                        outputs = train_module(frames)  # Outputs should have shape [batch_size, 1]
+
+                        # Ensure the output and labels have the same shape
+                        outputs = outputs.squeeze(1)  # Remove unnecessary dimensions (should have shape [batch_size])
 
-                # Ensure the output and labels have the same shape
-                outputs = outputs.squeeze(1)  # Remove unnecessary dimensions (should have shape [batch_size])
+                        # Make sure labels are float for BCEWithLogitsLoss
+                        loss = criterion(outputs.float(), labels.float())  # Binary cross entropy loss with logits
 
-                # Make sure labels are float for BCEWithLogitsLoss
-                loss = criterion(outputs, labels.float())  # Binary cross entropy loss with logits
-                loss.backward()
-                optimizer.step()
+                    # Average the gradients over the accumulated micro-batches
+                    scaler.scale(loss / accumulation_steps).backward()
+                if step:
+                    scaler.step(optimizer)
+                    scaler.update()
+                    optimizer.zero_grad()
                 
                 running_loss += loss.item()
+                samples_seen += labels.size(0)
                 if batch_idx % 10 == 0:
-                    print(f'Epoch: {epoch+1}/{num_epochs}, Batch: {batch_idx}, Loss: {loss.item():.4f}')
+                    log(f'Epoch: {epoch+1}/{num_epochs}, Batch: {batch_idx}, Loss: {loss.item():.4f}')
             
-            avg_loss = running_loss / len(train_loader)
-            print(f'Epoch [{epoch+1}/{num_epochs}], Average Loss: {avg_loss:.4f}')
+            epoch_time = time.perf_counter() - epoch_start
+            epoch_totals = torch.tensor([running_loss, len(train_loader), samples_seen], dtype=torch.float64, device=device)
+            if distributed:
+                # Loss averaged and throughput summed over all ranks
+                dist.all_reduce(epoch_totals)
+            avg_loss = (epoch_totals[0] / epoch_totals[1]).item()
+            log(f'Epoch [{epoch+1}/{num_epochs}], Average Loss: {avg_loss:.4f}, '
+                f'{epoch_totals[2].item() / epoch_time:.1f} samples/sec, Peak memory: {_peak_memory_mb():.0f} MB')
+
+            # Select the best model and drive the scheduler on validation loss
+            if len(val_loader) > 0:
+                val_loss, val_accuracy = validate(eval_module, val_loader, criterion, device)
+                log(f'Epoch [{epoch+1}/{num_epochs}], Validation Loss: {val_loss:.4f}, Accuracy: {val_accuracy:.2f}%')
+            else:
+                val_loss = avg_loss
+            scheduler.step(val_loss)
+
+            if val_loss < best_val_loss:
+                best_val_loss = val_loss
+                epochs_without_improvement = 0
+                if is_main_process():
+                    atomic_save(model.state_dict(), model_path)
+                    log(f"New best model saved to {model_path}")
+            else:
+                epochs_without_improvement += 1
+
+            if is_main_process() and ((epoch + 1) % checkpoint_every == 0 or epoch + 1 == num_epochs):
+                save_checkpoint(latest_checkpoint, model, optimizer, scheduler, scaler,
+                                epoch, best_val_loss, epochs_without_improvement)
+
+            # Validation loss is reduced across ranks, so every rank stops at the same epoch
+            if epochs_without_improvement >= early_stopping_patience:
+                log(f"Validation loss has not improved for {early_stopping_patience} epochs, stopping early")
+                if is_main_process():
+                    save_checkpoint(latest_checkpoint, model, optimizer, scheduler, scaler,
+                                    epoch, best_val_loss, epochs_without_improvement)
+                break
         
-        # Save the model
-        torch.save(model.state_dict(), model_path)
-        print(f"Model saved to {model_path}")
+        log(f"Training finished, best validation loss {best_val_loss:.4f}, model saved to {model_path}")
         
     except Exception as e:
-        print(f"Error during training: {e}")
+        print(f"Error during training on rank {rank}: {e}")
 
 def validate(model, val_loader, criterion, device):
     model.eval()
@@ -141,15 +415,27 @@ def validate(model, val_loader, criterion, device):
         for frames, labels in val_loader:
             frames, labels = frames.to(device), labels.to(device)
             outputs = model(frames)
-            loss = criterion(outputs.squeeze(), labels.float())
+            # squeeze(1), not squeeze(): a last batch of one sample must keep its batch dimension
+            loss = criterion(outputs.squeeze(1), labels.float())
             val_loss += loss.item()
             
-            predicted = (torch.sigmoid(outputs.squeeze()) > 0.5).float()
+            predicted = (torch.sigmoid(outputs.squeeze(1)) > 0.5).float()
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
     
+    num_batches = len(val_loader)
+    if dist.is_available() and dist.is_initialized():
+        # Every rank validated its own shard, sum the counts before averaging
+        totals = torch.tensor([val_loss, correct, total, num_batches], dtype=torch.float64, device=device)
+        dist.all_reduce(totals)
+        val_loss, correct, total, num_batches = totals.tolist()
+    
     accuracy = 100 * correct / total
-    return val_loss / len(val_loader), accuracy
+    return val_loss / num_batches, accuracy
 
 if __name__ == "__main__":
-    train_model_if_needed(force_train=True, num_epochs=num_epochs)
+    setup_distributed()
+    try:
+        train_model_if_needed(force_train=True, num_epochs=num_epochs)
+    finally:
+        cleanup_distributed()
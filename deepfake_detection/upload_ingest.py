@@ -0,0 +1,238 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+import numpy as np
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from data_preprocessing import _sample_positions
+
+try:
+    import av  # PyAV, optional: decodes streamable containers while they upload
+except ImportError:
+    av = None
+
+# Containers that can be demuxed front to back without seeking
+STREAMABLE_TYPES = ('video/mp2t', 'video/webm', 'video/x-matroska')
+STREAMABLE_EXTENSIONS = ('.ts', '.webm', '.mkv')
+
+class _Backing:
+    """
+    The bytes of one upload, in an anonymous file that is freed when its last user closes it.
+
+    It is a memfd (RAM only, Linux) when in_memory is set, else an unlinked temporary file.
+    Both are opened by path through /proc/self/fd. Without /proc, a named temporary file
+    is used and removed on the last release.
+    """
+
+    def __init__(self, in_memory=True):
+        self._lock = threading.Lock()
+        self._refs = 1
+        self._named_path = None
+        if in_memory and hasattr(os, 'memfd_create'):
+            self.fd = os.memfd_create('deepfake-upload')
+            self.path = f'/proc/self/fd/{self.fd}'
+        elif os.path.isdir('/proc/self/fd'):
+            with tempfile.TemporaryFile() as f:
+                self.fd = os.dup(f.fileno())
+            self.path = f'/proc/self/fd/{self.fd}'
+        else:
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                self.fd = os.dup(f.fileno())
+            self.path = self._named_path = f.name
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs:
+                return
+        os.close(self.fd)
+        if self._named_path is not None:
+            os.remove(self._named_path)
+
+class UploadHandle:
+    """Keeps an upload readable at `path` after its request has finished, e.g. for a queued job."""
+
+    def __init__(self, backing):
+        backing.acquire()
+        self._backing = backing
+        self.path = backing.path
+
+    def close(self):
+        if self._backing is not None:
+            self._backing.release()
+            self._backing = None
+
+class UploadSpool(io.RawIOBase):
+    def __init__(self, max_bytes=None, in_memory=True, decode_frames=0):
+        """
+        Receives an uploaded file from werkzeug's form parser, hashing it and enforcing a size limit.
+
+        The bytes go to an anonymous in-memory file that decoders open at `path`. With
+        `decode_frames` (streamable containers only, needs PyAV) they are also piped to a
+        thread that decodes the sampled frames while the rest of the body is still arriving.
+
+        Args:
+            max_bytes (int, optional): Largest accepted upload, bigger ones raise RequestEntityTooLarge.
+            in_memory (bool): Keep the upload in a memfd rather than an unlinked temporary file.
+            decode_frames (int): Number of frames to sample while uploading, 0 disables it.
+        """
+        super(UploadSpool, self).__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._backing = _Backing(in_memory)
+        self._file = open(self._backing.fd, 'r+b', buffering=0, closefd=False)
+        self.path = self._backing.path
+
+        self._frames = None
+        self._pipe = None
+        self._decoder = None
+        if decode_frames and av is not None:
+            read_fd, self._pipe = os.pipe()
+            self._decoder = threading.Thread(target=self._decode, args=(read_fd, decode_frames), daemon=True)
+            self._decoder.start()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            # Stops the decoder and frees the bytes now, werkzeug drops the spool without closing it
+            self.close()
+            raise RequestEntityTooLarge(f"Uploads are limited to {self.max_bytes} bytes")
+        self._digest.update(data)
+        self._file.write(data)
+        if self._pipe is not None:
+            self._feed_decoder(data)
+        return len(data)
+
+    def _feed_decoder(self, data):
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(self._pipe, view):]
+        except BrokenPipeError:
+            # The decoder has every sampled frame (or gave up), the rest only goes to the spool
+            self._close_pipe()
+
+    def _close_pipe(self):
+        if self._pipe is not None:
+            os.close(self._pipe)
+            self._pipe = None
+
+    def _decode(self, read_fd, num_frames):
+        try:
+            with os.fdopen(read_fd, 'rb') as pipe, av.open(pipe) as container:
+                stream = container.streams.video[0]
+                total_frames = stream.frames
+                if not total_frames and container.duration and stream.average_rate:
+                    total_frames = int(container.duration / av.time_base * stream.average_rate)
+                if total_frames <= 0:
+                    # Without a frame count the fixed-interval positions are unknown, decode from the spool later
+                    return
+
+                # Same positions as data_preprocessing.decode_frames, only they are converted to arrays
+                wanted = sorted(set(_sample_positions(total_frames, num_frames)))
+                frames = []
+                for position, frame in enumerate(container.decode(stream)):
+                    if position == wanted[len(frames)]:
+                        frames.append(frame.to_ndarray(format='bgr24'))
+                        if len(frames) == len(wanted):
+                            break
+                if frames:
+                    self._frames = np.stack(frames)
+        except Exception as e:
+            print(f"Decoding while uploading failed, decoding from the spooled upload instead: {e}")
+
+    def hexdigest(self):
+        """SHA-256 of the upload, as feature_cache.content_hash would compute it."""
+        return self._digest.hexdigest()
+
+    def decoded_frames(self):
+        """
+        Waits for the decoder once the upload is complete.
+
+        Returns:
+            np.ndarray: The sampled BGR frames, or None when they must be decoded from `path`.
+        """
+        if self._decoder is None:
+            return None
+        self._close_pipe()  # End of the upload, the decoder reads EOF
+        self._decoder.join()
+        self._decoder = None
+        return self._frames
+
+    def keep(self):
+        """Returns an UploadHandle that keeps the bytes after this spool (and its request) is closed."""
+        return UploadHandle(self._backing)
+
+    def close(self):
+        if self.closed:
+            return
+        self._close_pipe()
+        if self._decoder is not None:
+            self._decoder.join()
+        self._file.close()
+        self._backing.release()
+        super(UploadSpool, self).close()
+
+class IngestRequest(Request):
+    """
+    Flask request whose file uploads are written to an UploadSpool instead of werkzeug's
+    default temporary file. Configure the class attributes before serving.
+    """
+
+    max_upload_bytes = None
+    spool_in_memory = True
+    decode_frames = 0  # Frames decoded while uploading streamable containers, 0 disables it
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        streamable = content_type in STREAMABLE_TYPES or (filename or '').lower().endswith(STREAMABLE_EXTENSIONS)
+        spool = UploadSpool(
+            max_bytes=self.max_upload_bytes,
+            in_memory=self.spool_in_memory,
+            decode_frames=self.decode_frames if streamable else 0
+        )
+        self.__dict__.setdefault('_spools', []).append(spool)
+        return spool
+
+    def _load_form_data(self):
+        try:
+            super(IngestRequest, self)._load_form_data()
+        except BaseException:
+            # A body that fails to parse (too large, client disconnected) never reaches request.files,
+            # so its spools, their decoder threads and pipes are released here
+            self._close_spools(keep=())
+            raise
+        # Werkzeug drops the files of a malformed body without raising, request.close() only closes request.files
+        files = self.__dict__.get('files')
+        self._close_spools(keep={id(f.stream) for _, f in files.items(multi=True)} if files is not None else ())
+
+    def _close_spools(self, keep):
+        for spool in self.__dict__.pop('_spools', []):
+            if id(spool) not in keep:
+                spool.close()